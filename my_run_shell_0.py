@@ -16,14 +16,86 @@ see https://peps.python.org/pep-0008 and https://peps.python.org/pep-0257/
 (Note: The breakdown into Input/Action/Output in this script is just a suggestion.)
 """
 
-from datetime import datetime
-import os, shutil, sys
+import time
+STARTUP = [("start", time.perf_counter())]     # (phase, time it ended), reported by --startup-profile
 
-from colorama import Fore
+# Only cheap modules are imported here; asyncio, shutil, pwd, colorama and the like are
+# imported by the commands that need them, so a short batch run never pays for them.
+import collections, contextlib, errno, functools, io, os, signal, stat, sys
+STARTUP.append(("imports", time.perf_counter()))
 
-# Here the path is hardcoded, but you can easily optionally get your PATH environ variable
-# by using: path = os.environ['PATH'] and then splitting based on ':' such as the_path = path.split(':')
-THE_PATH = ["/bin/", "/usr/bin/", "/usr/local/bin/", "./"]
+
+class PlainColors:
+    """Stands in for colorama's Fore when output is not a terminal: every color is empty text."""
+
+    def __getattr__(self, name):
+        return ""
+
+
+def loadColors():
+    """Returns colorama's Fore when stdout is a terminal (and colorama is installed), else PlainColors()."""
+    if sys.stdout.isatty():
+        try:
+            from colorama import Fore
+            return Fore
+        except ImportError:
+            pass
+    return PlainColors()
+
+
+Fore = loadColors()
+STARTUP.append(("colors", time.perf_counter()))
+
+# Fallback search path, used only when the PATH environment variable is unset or empty
+DEFAULT_PATH = ["/bin/", "/usr/bin/", "/usr/local/bin/", "./"]
+
+
+def getPath():
+    """Returns the list of directories to search for executables.
+
+    Input: no function arguments (reads os.environ['PATH'])
+    Action: splits PATH on ':' and makes sure each entry ends in '/'
+    Output: returns list of directory names (DEFAULT_PATH if PATH is unset)
+    """
+    path = os.environ.get('PATH', '')
+    dirs = [(d or '.').rstrip('/') + '/' for d in path.split(':')] if path else []
+    return dirs or list(DEFAULT_PATH)
+
+
+THE_PATH = getPath()
+
+# Resolved-executable cache used by add_path:
+#   PATH_INDEX maps an absolute directory to (mtime_ns, {name: full path}), built by one scan per directory;
+#              a directory that is missing or cannot be stat'ed is kept as (None, {})
+#   PATH_RESOLVED maps a command name to the full path it last resolved to
+#   PATH_STATS counts lookups answered from PATH_RESOLVED (hits) and those that had to consult the index (misses)
+PATH_INDEX = {}
+PATH_RESOLVED = {}
+PATH_STATS = {"hits": 0, "misses": 0}
+
+# Exit status of the most recent command
+LAST_STATUS = 0
+
+# Run-time settings, changed with the set command. SETTING_CHOICES lists the accepted values.
+#   launcher: how external programs are started, "spawn" (os.posix_spawn) or "fork" (os.fork + os.execv)
+#   trace:    file that receives one JSON line per command run, or "off"
+#   fastpath: "on" runs ls, cat, echo, true, false, pwd, mkdir and touch in-process (see FAST PATHS)
+SETTINGS = {
+    "launcher": os.environ.get("PSHELL_LAUNCHER", "spawn" if hasattr(os, "posix_spawn") else "fork"),
+    "trace": os.environ.get("PSHELL_TRACE", "off"),
+    "fastpath": os.environ.get("PSHELL_FASTPATH", "off"),
+}
+SETTING_CHOICES = {
+    "launcher": ("spawn", "fork") if hasattr(os, "posix_spawn") else ("fork",),
+    "trace": None,      # any file name
+    "fastpath": ("on", "off"),
+}
+
+# Resources used by waited-for children: CPU seconds summed, maxrss (KB) the largest seen
+CHILD_USAGE = {"user": 0.0, "sys": 0.0, "maxrss": 0}
+
+# Signals Python ignores that a launched program should get back with their default action
+RESET_SIGNALS = (signal.SIGPIPE, signal.SIGTTOU, signal.SIGXFSZ)
 
 # ========================
 #   Run command
@@ -31,11 +103,11 @@ THE_PATH = ["/bin/", "/usr/bin/", "/usr/local/bin/", "./"]
 #   Any number of arguments
 # ========================
 def runCmd(fields):
-    """Returns nothing (after trying to execute user command expressed in fields).
+    """Returns the exit status of the user command expressed in fields.
     
     Input: takes a list of text fields (and global list of directories to search)
-    Action: executes command
-    Output: returns no return value
+    Action: executes command and waits for it to finish
+    Output: returns the command's exit status (127 if it cannot be found or started)
     """
     
     global THE_PATH
@@ -46,25 +118,103 @@ def runCmd(fields):
     # run the executable
     if execname == None:
         print ("Executable file", cmd, "not found")
-    else:
-        # execute the command
-        print(execname)
+        return 127
+
+    try:
+        pid = launchProgram(execname, fields)
+    except OSError as error:
+        print("Something went wrong there:", error.strerror)
+        return 127 if isinstance(error, (FileNotFoundError, PermissionError)) else 1
+
+    return waitChild(pid)
+
+
+def waitChild(pid):
+    """Returns the exit status of child pid after waiting for it with os.wait4.
+
+    The child's user/sys CPU time and max RSS are added to CHILD_USAGE. A Ctrl-C while
+    waiting does not abandon the child: the terminal sent SIGINT to it too, so the wait
+    goes on and collects its status (-2 if it died of it, as for any signal).
+    """
+    while True:
+        try:
+            _, status, usage = os.wait4(pid, 0)
+            break
+        except KeyboardInterrupt:
+            continue
+    CHILD_USAGE["user"] += usage.ru_utime
+    CHILD_USAGE["sys"] += usage.ru_stime
+    CHILD_USAGE["maxrss"] = max(CHILD_USAGE["maxrss"], usage.ru_maxrss)
+    return os.waitstatus_to_exitcode(status)
+
+
+def launchProgram(execname, fields, stdin=None, stdout=None, pgid=None, stderr=None):
+    """Returns the pid of a new child process running execname.
+
+    Input: takes the full path of an executable, the list of text fields to pass as argv,
+           optional fds to use as the child's stdin/stdout, an optional process group
+           (0 starts a new group led by the child) and an optional fd for stderr
+    Action: starts the program with os.posix_spawn when SETTINGS["launcher"] is "spawn"
+            (no page tables to copy, however large the shell has grown), otherwise with
+            os.fork followed by os.execv
+    Output: returns the child's pid (raises OSError if the program cannot be started)
+    """
+    # flush first so earlier builtin output comes out before the child's (and, with fork,
+    # is not written twice)
+    sys.stdout.flush()
+    if SETTINGS["launcher"] == "spawn":
+        actions = []
+        for fd, target in ((stdin, 0), (stdout, 1), (stderr, 2)):
+            if fd is not None and fd != target:
+                actions.append((os.POSIX_SPAWN_DUP2, fd, target))
+        options = {"setpgroup": pgid} if pgid is not None else {}
+        return os.posix_spawn(execname, fields, os.environ, file_actions=actions,
+                              setsigdef=RESET_SIGNALS, setsigmask=(), **options)
 
 # execv executes a new program, replacing the current process; on success, it does not return.
 # On Linux systems, the new executable is loaded into the current process, and will have the same process id as the caller.
-    try:
-        #creates child, if in child then os.execv, else wait for child
-        pid = os.fork()
+    #creates child, if in child then os.execv, else return the child's pid
+    pid = os.fork()
+    if pid == 0:
+        try:
+            if pgid is not None:
+                os.setpgid(0, pgid)
+            redirectStdio(stdin, stdout, stderr)
+            for signum in RESET_SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_SETMASK, [])
+        finally:
+            execProgram(execname, fields)
+    return pid
+
+
+def redirectStdio(stdin, stdout, stderr=None):
+    """Makes fds stdin, stdout and stderr (any may be None) the current process's fds 0, 1 and 2.
+
+    An fd given for more than one target is only closed after its last dup2.
+    """
+    targets = ((stdin, 0), (stdout, 1), (stderr, 2))
+    for fd, target in targets:
+        if fd is not None and fd != target:
+            os.dup2(fd, target)
+    for fd in set(fd for fd, _ in targets):
+        if fd is not None and fd > 2:
+            os.close(fd)
 
-        if pid == 0:
-            os.execv(execname, fields)
-            os.exit(0)
-        else:
-            os.wait()
-        
-    except :
-        print("Something went wrong there")
-        os._exit(0)
+
+def execProgram(execname, fields):
+    """Does not return: replaces the current (child) process with execname.
+
+    Input: takes the full path of an executable and the list of text fields to pass as argv
+    Action: execv's the program; if that fails the child exits with status 127
+    Output: never returns
+    """
+    try:
+        os.execv(execname, fields)
+    except OSError as error:
+        sys.stderr.write(fields[0] + ": " + error.strerror + "\n")
+    finally:
+        os._exit(127)
 
 # ========================
 #   Constructs the full path used to run the external command
@@ -75,272 +225,4170 @@ def add_path(cmd, executable_dirs):
     """Returns command with full path when possible and None otherwise.
     
     Input: takes a command and a list of paths to search
-    Action: no actions
+    Action: looks the command up in the resolved-executable cache, trusting a hit only while
+            the search directories up to the one it was found in keep their mtimes;
+            otherwise refreshes the per-directory index (by directory mtime)
     Output: returns external command prefaced by full path
             (returns None if executable file cannot be found in any of the paths)
     """
-    if cmd[0] not in ['/', '.']:
-        for dir in executable_dirs:
+    if cmd[0] in ['/', '.']:
+        return cmd
+
+    execname = PATH_RESOLVED.get(cmd)
+    if execname is not None and resolvedIsFresh(cmd, execname, executable_dirs):
+        PATH_STATS["hits"] += 1
+        return execname
+
+    PATH_STATS["misses"] += 1
+    for dir in executable_dirs:
+        if os.path.isabs(dir):
+            execname = scanPathDir(dir).get(cmd)
+            if execname is not None:
+                PATH_RESOLVED[cmd] = execname
+                return execname
+        else:
+            # relative entries such as "./" depend on the working directory, so never cache them
             execname = dir + cmd
             if os.path.isfile(execname) and os.access(execname, os.X_OK):
                 return execname
+    return None
+
+
+def resolvedIsFresh(cmd, execname, executable_dirs):
+    """Returns True if the cached execname is still what a search for cmd would find.
+
+    Input: takes a command, the full path it last resolved to and the list of search directories
+    Action: stats each search directory up to and including the one holding execname: an
+            absolute one must still have the mtime it was indexed with, or still be missing
+            (so nothing was added to an earlier directory or removed from this one), a relative
+            one must not hold cmd
+    Output: returns True if the cache entry can be used, False if the command must be looked up again
+    """
+    home = execname[:execname.rindex("/") + 1]
+    for dir in executable_dirs:
+        if os.path.isabs(dir):
+            cached = PATH_INDEX.get(dir)
+            if cached is None or pathDirMtime(dir) != cached[0]:
+                return False
+            if dir == home:
+                return True
+        elif os.path.isfile(dir + cmd):
+            return False
+    return False
+
+
+def pathDirMtime(dir):
+    """Returns the mtime (ns) of a search directory, or None if it cannot be stat'ed."""
+    try:
+        return os.stat(dir).st_mtime_ns
+    except OSError:
         return None
-    else:
-        return cmd
+
+
+def scanPathDir(dir):
+    """Returns the {name: full path} index of executables in one search directory.
+
+    Input: takes an absolute directory name (ending in '/')
+    Action: re-scans the directory only if its mtime differs from the cached one (a missing
+            directory is remembered as missing); a rescan drops any PATH_RESOLVED entries
+            that pointed into the directory
+    Output: returns dictionary of executable names to full paths (empty if missing or unreadable)
+    """
+    mtime = pathDirMtime(dir)
+    cached = PATH_INDEX.get(dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    names = {}
+    try:
+        with os.scandir(dir) as it:
+            for entry in it:
+                try:
+                    if entry.is_file() and os.access(entry.path, os.X_OK):
+                        names[entry.name] = dir + entry.name
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+    if cached is not None:
+        for name, execname in list(PATH_RESOLVED.items()):
+            if execname.startswith(dir) and "/" not in execname[len(dir):]:
+                del PATH_RESOLVED[name]
+    PATH_INDEX[dir] = (mtime, names)
+    return names
 
 # ========================
-#   files command
-#   List file and directory names
+#   rehash command
+#   Forget every cached executable location and re-read PATH
 #   No arguments
 # ========================
-def filesCmd(fields):
-    """Return nothing after printing names/types of files/dirs in working directory.
-    
+def rehashCmd(fields):
+    """Return nothing after rebuilding the resolved-executable cache.
+
     Input: takes a list of text fields
-    Action: prints for each file/dir in current working directory their type and name
-            (unless list is non-empty in which case an error message is printed)
-    Output: returns no return value
+    Action: re-reads PATH, clears the cache, rescans every search directory and
+            prints the number of executables found and the hit/miss counters so far
+    Output: returns exit status (0 on success, 1 on error)
     """
-    
-    if checkArgs(fields, 0):
-        for filename in os.listdir('.'):
-            if os.path.isdir(os.path.abspath(filename)):
-                print("dir:", filename)
+
+    global THE_PATH
+    if not checkArgs(fields, 0):
+        return 1
+    print("Path cache: " + str(PATH_STATS["hits"]) + " hits, " + str(PATH_STATS["misses"]) + " misses")
+    THE_PATH = getPath()
+    PATH_INDEX.clear()
+    PATH_RESOLVED.clear()
+    PATH_STATS["hits"] = PATH_STATS["misses"] = 0
+    found = 0
+    for dir in THE_PATH:
+        if os.path.isabs(dir):
+            found += len(scanPathDir(dir))
+    print("Indexed", found, "executables in", len(THE_PATH), "directories")
+    return 0
+
+# ========================
+#   Command line parser
+#   Turns a line into a CommandList AST:
+#       list     := and_or ((";" | "&") and_or)* [";" | "&"]
+#       and_or   := pipeline (("&&" | "||") pipeline)*
+#       pipeline := ["time"] command ("|" command)*
+#       command  := (word | redirect)+        redirect := ("<" | ">" | ">>") word
+#   Words keep their quoting resolved but their $VAR / ${VAR} / $? / $$ references
+#   unexpanded, so a parsed line can be cached and re-run with fresh values.
+# ========================
+PARSE_CACHE_SIZE = 512
+OPERATORS = ("||", "&&", ">>", "|", "&", ";", "<", ">")
+REDIRECTS = ("<", ">", ">>")
+WORD_BREAKS = " \t\n|&;<>"
+
+# parts is a tuple of (is variable, text) pairs; quoted records whether any part was quoted
+Word = collections.namedtuple("Word", "parts quoted")
+Command = collections.namedtuple("Command", "words redirects")
+Pipeline = collections.namedtuple("Pipeline", "commands timed text")
+AndOr = collections.namedtuple("AndOr", "first rest text")
+CommandList = collections.namedtuple("CommandList", "items")
+
+
+class ParseError(Exception):
+    """Raised when a command line cannot be tokenized or parsed."""
+
+
+def tokenize(line):
+    """Returns the tokens of line.
+
+    Input: takes a line of text
+    Action: splits it into operators and words, resolving '...' and "..." quoting and
+            backslash escapes; an unquoted # starting a word begins a comment
+    Output: returns list of (kind, value, start, end) tuples, where kind is "op" (value is the
+            operator text) or "word" (value is a Word); raises ParseError on an unterminated quote
+    """
+    tokens = []
+    i = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c in " \t\n":
+            i += 1
+            continue
+        if c == '#':
+            break
+        if c in "|&;<>":
+            operator = line[i:i + 2] if line[i:i + 2] in OPERATORS else c
+            tokens.append(("op", operator, i, i + len(operator)))
+            i += len(operator)
+            continue
+
+        start = i
+        parts = []
+        text = []
+        quoted = False
+        while i < n and line[i] not in WORD_BREAKS:
+            c = line[i]
+            if c == "\\":
+                text.append(line[i + 1:i + 2])
+                quoted = True
+                i += 2
+            elif c == "'":
+                close = line.find("'", i + 1)
+                if close < 0:
+                    raise ParseError("unterminated ' quote")
+                text.append(line[i + 1:close])
+                quoted = True
+                i = close + 1
+            elif c == '"':
+                quoted = True
+                i += 1
+                while True:
+                    if i >= n:
+                        raise ParseError('unterminated " quote')
+                    c = line[i]
+                    if c == '"':
+                        i += 1
+                        break
+                    if c == "\\" and line[i + 1:i + 2] in ('"', "\\", "$"):
+                        text.append(line[i + 1])
+                        i += 2
+                    elif c == "$":
+                        i = readVariable(line, i, parts, text)
+                    else:
+                        text.append(c)
+                        i += 1
+            elif c == "$":
+                i = readVariable(line, i, parts, text)
+            else:
+                text.append(c)
+                i += 1
+        if text:
+            parts.append((False, "".join(text)))
+        tokens.append(("word", Word(tuple(parts), quoted), start, i))
+    return tokens
+
+
+def readVariable(line, i, parts, text):
+    """Returns the index after a $ reference starting at line[i], appending it to parts.
+
+    Literal text gathered so far is moved from text into parts first. A $ not followed by
+    a name, {name}, ? or $ stays a literal dollar sign.
+    """
+    following = line[i + 1:i + 2]
+    if following == "{":
+        close = line.find("}", i + 2)
+        if close < 0:
+            raise ParseError("unterminated ${")
+        name, end = line[i + 2:close], close + 1
+        if not (name.isidentifier() or name in ("?", "$")):
+            raise ParseError("bad substitution ${" + name + "}")
+    elif following in ("?", "$"):
+        name, end = following, i + 2
+    elif following.isidentifier():
+        end = i + 1
+        while end < len(line) and (line[end].isalnum() or line[end] == "_"):
+            end += 1
+        name = line[i + 1:end]
+    else:
+        text.append("$")
+        return i + 1
+    if text:
+        parts.append((False, "".join(text)))
+        text.clear()
+    parts.append((True, name))
+    return end
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parseLine(line):
+    """Returns the CommandList AST of line (cached: repeated lines are parsed only once).
+
+    Input: takes a line of text
+    Action: tokenizes and parses the line with the grammar above
+    Output: returns CommandList (with no items for a blank or comment line);
+            raises ParseError for a syntax error
+    """
+    tokens = tokenize(line)
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else ("end", None, len(line), len(line))
+
+    def isOp(*operators):
+        kind, value, _, _ = peek()
+        return kind == "op" and value in operators
+
+    def parseCommand(after):
+        words = []
+        redirects = []
+        while True:
+            kind, value, _, _ = peek()
+            if kind == "word":
+                words.append(value)
+                position[0] += 1
+            elif kind == "op" and value in REDIRECTS:
+                position[0] += 1
+                kind, target, _, _ = peek()
+                if kind != "word":
+                    raise ParseError("missing file name after " + value)
+                redirects.append((value, target))
+                position[0] += 1
             else:
-                print("file:", filename)
+                break
+        if not words:
+            kind, value, _, _ = peek()
+            if kind == "op":
+                raise ParseError("missing command before " + value)
+            raise ParseError("missing command after " + after if after else "missing command")
+        return Command(tuple(words), tuple(redirects))
+
+    def parsePipeline(after):
+        start = peek()[2]
+        kind, value, _, _ = peek()
+        timed = kind == "word" and value == Word(((False, "time"),), False)
+        if timed:
+            position[0] += 1
+            after = "time"
+        commands = [parseCommand(after)]
+        while isOp("|"):
+            position[0] += 1
+            commands.append(parseCommand("|"))
+        end = tokens[position[0] - 1][3]
+        return Pipeline(tuple(commands), timed, line[start:end])
+
+    def parseAndOr(after):
+        start = peek()[2]
+        first = parsePipeline(after)
+        rest = []
+        while isOp("&&", "||"):
+            operator = peek()[1]
+            position[0] += 1
+            rest.append((operator, parsePipeline(operator)))
+        end = tokens[position[0] - 1][3]
+        return AndOr(first, tuple(rest), line[start:end])
+
+    items = []
+    while position[0] < len(tokens):
+        andOr = parseAndOr(None)
+        background = False
+        if isOp(";", "&"):
+            background = peek()[1] == "&"
+            position[0] += 1
+        elif position[0] < len(tokens):
+            raise ParseError("unexpected " + peek()[1])
+        items.append((andOr, background))
+    return CommandList(tuple(items))
+
+
+def expandWord(word):
+    """Returns the text of word with its variable references replaced by their current values."""
+    return "".join(lookupVariable(text) if isVariable else text for isVariable, text in word.parts)
+
+
+def lookupVariable(name):
+    """Returns the value of $name: the last exit status for ?, the shell's pid for $, else the environment."""
+    if name == "?":
+        return str(LAST_STATUS)
+    if name == "$":
+        return str(os.getpid())
+    return os.environ.get(name, "")
+
+
+def expandCommand(command):
+    """Returns (fields, [(operator, file name), ...]) for a Command, expanding variables now.
+
+    An unquoted word that expands to nothing is dropped, as in sh.
+    """
+    fields = []
+    for word in command.words:
+        text = expandWord(word)
+        if text or word.quoted:
+            fields.append(text)
+    return fields, [(operator, expandWord(target)) for operator, target in command.redirects]
 
 # ========================
-#  info command
-#   List file information
-#   1 argument: file name
+#   Pipelines and I/O redirection
+#   cmd1 args | cmd2 args ...  with  < file,  > file  and  >> file  on any stage
 # ========================
-def infoCmd(fields):
-    """Return nothing after printing basic file information about target file.
-    
-    Input: takes a list of text fields
-    Action: prints our the name, owner, file/dir status, size (bytes), date of last access, date of last permissions mod, date of last
-    modification and if the program can be executed or not.  
-    Output: returns no return value
+def openRedirect(operator, filename):
+    """Returns (target fd, opened fd) for one redirection."""
+    if operator == "<":
+        return 0, os.open(filename, os.O_RDONLY)
+    if operator == ">":
+        return 1, os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    return 1, os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+
+
+def runRedirected(fields, redirects):
+    """Returns the exit status of one command run in the shell's own process with redirections.
+
+    Input: takes the command's text fields and its (operator, filename) redirections
+    Action: opens the redirections, saves fds 0 and 1, dup2's the targets onto them and
+            dispatches the command (so builtins such as cd, pushd, set and wait act on the
+            shell itself), then puts the saved fds back
+    Output: returns the command's exit status (1 if a redirection cannot be opened)
     """
+    opened = {}
+    try:
+        for operator, filename in redirects:
+            target, fd = openRedirect(operator, filename)
+            if target in opened:
+                os.close(opened[target])
+            opened[target] = fd
+    except OSError as error:
+        for fd in opened.values():
+            os.close(fd)
+        print(Fore.RED + "ERROR - " + error.filename + ": " + error.strerror + Fore.WHITE)
+        return 1
+
+    sys.stdout.flush()
+    saved = {target: os.dup(target) for target in opened}
+    try:
+        for target, fd in opened.items():
+            os.dup2(fd, target)
+            os.close(fd)
+        return COMMANDS.dispatch(fields)
+    finally:
+        sys.stdout.flush()
+        for target, fd in saved.items():
+            os.dup2(fd, target)
+            os.close(fd)
 
 
-    if checkArgs(fields, 1):
-            #Assign inputted param to var
-            filename = fields[1]
+def runPipeline(stages, background=False, text=None):
+    """Returns the exit status of the last stage after running a pipeline.
+
+    Input: takes a list of (fields, redirects) stages as returned by expandCommand, whether to run it in the
+           background and the command text to show in the job table
+    Action: starts one child per stage with stdin/stdout wired to kernel pipes (os.pipe/dup2)
+            or redirected files; builtins run inside a forked child, other commands are
+            started with launchProgram.
+            A background pipeline gets its own process group and is added to the job table.
+    Output: returns exit status of the last stage (1 if a redirection cannot be opened,
+            0 straight away for a background pipeline)
+    """
+    pids = []
+    prevRead = None
+    lastPid = None
+    pgid = 0
+    if background:
+        # keep the SIGCHLD reaper away until the job is in the table
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+    try:
+        for i, (fields, redirects) in enumerate(stages):
+            stdin, stdout, nextRead = prevRead, None, None
+            if i < len(stages) - 1:
+                nextRead, stdout = os.pipe()
+            opened = {}
             try:
-                #Have an OS.stat object
-                Result = os.stat(filename)
-                #Pull and print info
-                print(Fore.BLUE + 'Name: ' + Fore.WHITE +filename)
-                print(Fore.BLUE + "Owner: " +Fore.WHITE + pwd.getpwuid(Result.st_uid).pw_name)
-                
-                #determine dir or file type.
-                if (os.path.isdir(filename)):
-                    print(Fore.BLUE + "Type: " +Fore.WHITE +"Dir")
-                else:
-                    #Print extra info
-                    print(Fore.BLUE + "Type: " +Fore.WHITE +"File")
-                    print(Fore.BLUE + 'Size (Bytes): ' + Fore.WHITE + str(Result.st_size))
-                    print(Fore.BLUE + 'Date of last access: ' +Fore.WHITE + datetime.fromtimestamp(os.path.getatime(filename)).strftime('%b %d %Y %H:%M:%S'))
-                    print(Fore.BLUE + 'Date of last access permissions modification: ' +Fore.WHITE + datetime.fromtimestamp(os.path.getctime(filename)).strftime('%b %d %Y %H:%M:%S'))
-                
-                print(Fore.BLUE + 'Date of last modification: ' +Fore.WHITE + datetime.fromtimestamp(os.path.getmtime(filename)).strftime('%b %d %Y %H:%M:%S'))
-                print(Fore.BLUE + "Executable? : " +Fore.WHITE + str(os.access(os.path.abspath(filename), os.X_OK)))
-            #Error handling
-            except:
-                print(Fore.RED + "ERROR  - No file named: "+filename + Fore.WHITE)
-            
+                for operator, filename in redirects:
+                    target, fd = openRedirect(operator, filename)
+                    if target in opened:
+                        os.close(opened[target])
+                    opened[target] = fd
+            except OSError as error:
+                for fd in opened.values():
+                    os.close(fd)
+                for fd in (stdin, stdout, nextRead):
+                    if fd is not None:
+                        os.close(fd)
+                print(Fore.RED + "ERROR - " + error.filename + ": " + error.strerror + Fore.WHITE)
+                return 1
 
-# ====================================================
-#  Delete command, allows removal of file from system
-#       Deletes target file, provided it exists.
-#       1 Command argument: file name
-#=====================================================
+            fields, handler = COMMANDS.resolve(fields, fast=False)
+            stageIn, stageOut = opened.get(0, stdin), opened.get(1, stdout)
+            pid = None
+            if handler is not COMMANDS.fallback:
+                sys.stdout.flush()
+                pid = os.fork()
+                if pid == 0:
+                    if nextRead is not None:
+                        os.close(nextRead)
+                    if background:
+                        os.setpgid(0, pgid)
+                        signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+                    runStage(handler, fields, stageIn, stageOut)
+            else:
+                execname = add_path(fields[0], THE_PATH)
+                try:
+                    if execname is None:
+                        raise FileNotFoundError(0, "not found")
+                    pid = launchProgram(execname, fields, stageIn, stageOut, pgid if background else None)
+                except OSError as error:
+                    sys.stdout.flush()
+                    sys.stderr.write("Executable file " + fields[0] + " " + error.strerror + "\n")
 
-def deleteCmd(fields):
+            if pid is not None:
+                if background:
+                    pgid = pgid or pid
+                    try:
+                        os.setpgid(pid, pgid)
+                    except OSError:
+                        pass    # the child already did it (and may have exec'd)
+                pids.append(pid)
+            lastPid = pid
+            for fd in [stdin, stdout] + list(opened.values()):
+                if fd is not None:
+                    os.close(fd)
+            prevRead = nextRead
+        if background and pids:
+            job = addJob(pgid, pids, text or " ".join(" ".join(fields) for fields, _ in stages))
+            print("[" + str(job.id) + "]", pids[-1])
+            pids = []
+            return 0
+    finally:
+        status = 127
+        for pid in pids:
+            waited = waitChild(pid)
+            if pid == lastPid:
+                status = waited
+        if background:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+    return status
 
-    """Return nothing after pdeleting the target file. If filename cannot be found, throw error
-    
-    Input: takes a list of text fields
-    Action: deletes the targeted file and prints a success message.
-    Output: returns no return value
+
+def runStage(handler, fields, stdin, stdout):
+    """Does not return: runs one builtin pipeline stage inside its forked child.
+
+    Input: takes the builtin's handler, the stage's text fields and the fds to use as
+           stdin and stdout (None keeps the shell's)
+    Action: dup2's the fds onto 0/1, then runs the builtin in-process
+    Output: never returns (the child exits with the command's status)
     """
+    status = 1
+    try:
+        redirectStdio(stdin, stdout)
+        status = handler(fields) or 0
+    except SystemExit as exit:
+        status = exit.code if isinstance(exit.code, int) else 0
+    except BrokenPipeError:
+        # the reader went away: finish quietly with the status of a process killed by SIGPIPE
+        status = 128 + signal.SIGPIPE
+    except BaseException as error:
+        sys.stderr.write(fields[0] + ": " + str(error) + "\n")
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+        finally:
+            os._exit(status)
 
+# ========================
+#   Background jobs
+#   "cmd args &" runs a pipeline in the background; jobs, fg, bg and wait manage them.
+#   Finished children are reaped by a SIGCHLD handler using waitpid on the job pids only,
+#   so foreground waits always collect their own child.
+# ========================
+class Job:
+    """One background pipeline: its process group, member pids and state."""
 
-    if checkArgs(fields, 1):
-        filename = fields[1]
-        if os.path.exists(filename):
-            os.remove(filename)
-            print(Fore.BLUE + "File Removed." + Fore.WHITE)
-        else:
-            print(Fore.RED + "ERROR - File not found. Perhaps check your working directory?" + Fore.WHITE)
+    def __init__(self, id, pgid, pids, text):
+        self.id = id
+        self.pgid = pgid
+        self.pids = list(pids)
+        self.text = text
+        self.status = {}        # pid -> exit status, filled in as members finish
+        self.stopped = False
+        self.notified = False
 
+    def done(self):
+        """Returns True once every process of the job has finished."""
+        return len(self.status) == len(self.pids)
 
-# ====================================================
-#  Copy command, allows duplication of a selected file to a targeted name
-#       Duplucates soruce file, provided name of dest file does not exist
-#       2 Command arguments:  src file name, dest file name
-#=====================================================
+    def exitStatus(self):
+        """Returns the exit status of the last process in the job."""
+        return self.status.get(self.pids[-1], 0)
 
-def copyCmd(fields):
+    def state(self):
+        """Returns "Done", "Exit N", "Stopped" or "Running"."""
+        if self.done():
+            status = self.exitStatus()
+            return "Done" if status == 0 else "Exit " + str(status)
+        return "Stopped" if self.stopped else "Running"
 
-    """Return nothing after duplicating the target file. If src filename cannot be found, throw error. if DEST already exists, throw error
-    
-    Input: takes a list of text fields
-    Action: duplicates a target into filename of DEST
-    Output: returns no return value
+
+JOBS = {}           # job id -> Job
+JOB_PIDS = {}       # pid -> Job, for every job member that has not been reaped yet
+
+
+def addJob(pgid, pids, text):
+    """Returns a new Job registered in the job table under the lowest free job id."""
+    id = 1
+    while id in JOBS:
+        id += 1
+    job = Job(id, pgid, pids, text)
+    JOBS[id] = job
+    for pid in pids:
+        JOB_PIDS[pid] = job
+    return job
+
+
+def recordJobStatus(pid, status):
+    """Updates the job owning pid from a raw waitpid status."""
+    job = JOB_PIDS.get(pid)
+    if job is None:
+        return
+    if os.WIFSTOPPED(status):
+        job.stopped = True
+    elif os.WIFCONTINUED(status):
+        job.stopped = False
+    else:
+        del JOB_PIDS[pid]
+        job.status[pid] = os.waitstatus_to_exitcode(status)
+
+
+def reapJobs(signum=None, frame=None):
+    """Reaps finished or stopped background children without blocking (also the SIGCHLD handler)."""
+    for pid in list(JOB_PIDS):
+        try:
+            waited, status = os.waitpid(pid, os.WNOHANG | os.WUNTRACED | os.WCONTINUED)
+        except ChildProcessError:
+            JOB_PIDS.pop(pid, None)
+            continue
+        if waited:
+            recordJobStatus(waited, status)
+
+
+def pollJobs():
+    """Runs reapJobs outside the signal handler, with SIGCHLD blocked.
+
+    Otherwise the handler could run between a waitpid here and its recordJobStatus,
+    find the pid already reaped (ChildProcessError) and drop it, losing the status.
     """
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+    try:
+        reapJobs()
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
 
-    if checkArgs(fields, 2):
-        fromFile = fields[1]
-        toFile = fields[2]
-        if os.path.exists(fromFile) and not os.path.exists(toFile):
-            shutil.copyfile(fromFile, toFile)
-            print(Fore.BLUE + "File Copied successfully. " + Fore.WHITE)
-        else:
-            print(Fore.RED + "Error - Source file either does not exist or destination file already exists." + Fore.WHITE)
 
+def waitJob(job, foreground=False):
+    """Returns the job's exit status after blocking until it finishes or stops.
 
+    Input: takes a Job and whether to give it the terminal while waiting
+    Action: waits for each unfinished member with waitpid (SIGCHLD blocked so the reaper
+            cannot take the status first); a finished job is removed from the table
+    Output: returns exit status of the job's last process (148 if it was stopped)
+    """
+    terminal = foreground and sys.stdin.isatty()
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+    try:
+        if terminal:
+            os.tcsetpgrp(sys.stdin.fileno(), job.pgid)
+        for pid in job.pids:
+            while pid in JOB_PIDS and not job.stopped:
+                try:
+                    _, status = os.waitpid(pid, os.WUNTRACED)
+                except ChildProcessError:
+                    JOB_PIDS.pop(pid, None)
+                    break
+                recordJobStatus(pid, status)
+    finally:
+        if terminal:
+            os.tcsetpgrp(sys.stdin.fileno(), os.getpgrp())
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+    if job.stopped:
+        print()
+        print("[" + str(job.id) + "]", job.state(), job.text)
+        return 128 + signal.SIGTSTP
+    JOBS.pop(job.id, None)
+    return job.exitStatus()
+
+
+def notifyJobs():
+    """Prints and forgets background jobs that have finished since the last call."""
+    pollJobs()
+    for job in list(JOBS.values()):
+        if job.done():
+            print("[" + str(job.id) + "]", job.state(), job.text)
+            del JOBS[job.id]
+
+
+def findJob(fields):
+    """Returns the Job named by fields[1] (%n, n or a pid), or the newest job if absent; None if unknown."""
+    if len(fields) < 2:
+        return JOBS[max(JOBS)] if JOBS else None
+    spec = fields[1].lstrip('%')
+    if spec.isdigit():
+        number = int(spec)
+        if number in JOBS:
+            return JOBS[number]
+        for job in JOBS.values():
+            if number in job.pids:
+                return job
+    return None
 
 # ====================================================
-#  Where command,  prints name of current working directory
-#       
-#       0 Command arguments.
+#  Jobs command, lists background jobs
+#       0 Command arguments
 #=====================================================
 
-def whereCmd(feilds):
+def jobsCmd(fields):
+
+    """Return nothing after listing the job table
 
-    """Return nothing after printing the name of the current working dir as a string to console
-    
     Input: takes a list of text fields
-    Action: Prints current working dir to console
-    Output: returns no return value
+    Action: prints id, state and command of every background job
+    Output: returns exit status (0 on success, 1 on error)
     """
 
+    if not checkArgs(fields, 0):
+        return 1
+    pollJobs()
+    for id in sorted(JOBS):
+        job = JOBS[id]
+        print("[" + str(id) + "]", job.state().ljust(10), job.text)
+        if job.done():
+            del JOBS[id]
+    return 0
 
-    if checkArgs(feilds, 0):
-        print(os.getcwd())
+# ====================================================
+#  Fg / bg commands, resume a job in the foreground or background
+#       0 or 1 Command arguments: job (%n or pid), default newest job
+#=====================================================
 
+def fgCmd(fields):
 
-def downCmd(fields):
+    """Return the job's exit status after continuing it and waiting for it
 
-    """Return nothing after mocing into target sub diretory
-    
     Input: takes a list of text fields
-    Action: Move into target sub directory 
-    Output: returns no return value
+    Action: sends SIGCONT to the job's process group and waits for it in the foreground
+    Output: returns the job's exit status (1 if there is no such job)
     """
 
-    if checkArgs(fields, 1):
-        if os.path.exists(fields[1]):
-            try:
-                currentDir = os.getcwd()
-                os.chdir(currentDir +"/" +fields[1])
-            except:
-                print(Fore.RED + "ERROR" + Fore.WHITE)
+    job = findJob(fields)
+    if job is None or len(fields) > 2:
+        print(Fore.RED + "ERROR - No such job" + Fore.WHITE)
+        return 1
+    print(job.text)
+    job.stopped = False
+    try:
+        os.killpg(job.pgid, signal.SIGCONT)
+    except ProcessLookupError:
+        pass
+    return waitJob(job, foreground=True)
 
-        else:
-            print(Fore.RED + "ERROR - Directory not found" + Fore.WHITE)
 
-# ====================================================
-#  Up command, moves up the working dir tree
-#       0 commands
-#=====================================================
+def bgCmd(fields):
 
-def upCmd(fields):
+    """Return nothing after resuming a stopped job in the background
 
-    """Return nothing after moving up the working tree
-    
     Input: takes a list of text fields
-    Action: move up tree
-    Output: returns no return value
+    Action: sends SIGCONT to the job's process group
+    Output: returns exit status (0 on success, 1 on error)
     """
 
-    if checkArgs(fields, 0):
-        try:
-            if not os.getcwd() == "/":
-                os.chdir("..")
-            else:
-                print(Fore.RED + "ERROR -AT HOME DIRECTORY, CANNOT STEP BACK" + Fore.WHITE)
-        except:
-            print(Fore.RED + "ERROR - CANNOT STEP BACK" + Fore.WHITE)
-
+    job = findJob(fields)
+    if job is None or len(fields) > 2:
+        print(Fore.RED + "ERROR - No such job" + Fore.WHITE)
+        return 1
+    job.stopped = False
+    try:
+        os.killpg(job.pgid, signal.SIGCONT)
+    except ProcessLookupError:
+        pass
+    print("[" + str(job.id) + "]", job.text, "&")
+    return 0
 
 # ====================================================
-#  Exit command, Quit the shell
-#       0 commands
+#  Wait command, blocks until background jobs finish
+#       0 Command arguments: wait for every job
+#       1 Command argument: job (%n or pid)
 #=====================================================
 
-def exitCmd(fields):
+def waitCmd(fields):
 
-    """Return nothing after exiting the shell
+    """Return the exit status of the (last) job waited for
 
     Input: takes a list of text fields
-    Action: Exit the shell
-    Output: returns no return value
+    Action: waits for the given job, or for all jobs when none is given
+    Output: returns the job's exit status (127 if there is no such job)
     """
 
-    if checkArgs(fields, 0):
-        print(Fore.GREEN + "Goodbye..")
-        sys.exit()
+    if len(fields) > 2:
+        checkArgs(fields, 1)
+        return 1
+    if len(fields) == 2:
+        job = findJob(fields)
+        if job is None:
+            print(Fore.RED + "ERROR - No such job" + Fore.WHITE)
+            return 127
+        return waitJob(job)
+    status = 0
+    for id in sorted(JOBS):
+        if id in JOBS and not JOBS[id].stopped:
+            status = waitJob(JOBS[id])
+    return status
 
+# ====================================================
+#  Parallel command, runs one program over many inputs
+#       parallel [-j N] [-k] cmd [args] ::: input1 input2 ...
+#       parallel [-j N] [-k] cmd [args]          (one input per line of stdin)
+#  Each input is appended to the command, or replaces every "{}" in it.
+#=====================================================
 
+def cpuCount():
+    """Returns the number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
-# ----------------------
-# Other functions
-# ----------------------
-def checkArgs(fields, num):
-    """Returns if len(fields)-1 == num (prints error to shell if not).
-    
-    Input: takes a list of text fields and how many non-command fields are expected
-    Action: prints an error message if the number of fields is unexpected
-    Output: returns boolean value to indicate if it was expected number of fields
+
+def parseParallelArgs(fields):
+    """Returns (jobs, keep order, command fields, inputs) for the parallel command.
+
+    Inputs is a list when given after ":::" and a lazy iterator over stdin lines otherwise.
+    Raises ValueError on a bad -j value or a missing command.
     """
-    
-    numArgs = len(fields) - 1
-    if numArgs == num:
-        return True
-    if numArgs > num:
-        print("Unexpected argument", fields[num+1], "for command", fields[0])
+    jobs = cpuCount()
+    keepOrder = False
+    i = 1
+    while i < len(fields) and fields[i].startswith('-'):
+        if fields[i] == "-k":
+            keepOrder = True
+        elif fields[i].startswith("-j"):
+            value = fields[i][2:]
+            if not value:
+                i += 1
+                value = fields[i] if i < len(fields) else ""
+            jobs = int(value)
+            if jobs < 1:
+                raise ValueError("-j needs a positive number")
+        else:
+            raise ValueError("unknown option " + fields[i])
+        i += 1
+    rest = fields[i:]
+    if ":::" in rest:
+        split = rest.index(":::")
+        command, inputs = rest[:split], rest[split + 1:]
     else:
-        print("Missing argument for command", fields[0])
-    
-    return False
+        command = rest
+        inputs = (line.rstrip('\n') for line in sys.stdin if line.strip())
+    if not command:
+        raise ValueError("missing command")
+    return jobs, keepOrder, command, inputs
 
-# ---------------------------------------------------------------------
 
-def main():
-    """Returns exit code 0 (after executing the main part of this script).
-    
-    Input: no function arguments
-    Action: run multiple user-inputted commands
-    Output: return zero to indicate regular termination
+def parallelCmd(fields):
+
+    """Return the number of failed jobs after running a command once per input
+
+    Input: takes a list of text fields
+    Action: keeps up to N children (default: CPU count) running at once, each with stdout
+            and stderr captured through its own pipe; every job's output is printed as one
+            block when it finishes (in input order with -k), so outputs never interleave
+    Output: returns exit status (0 if every job succeeded, otherwise the number of failed
+            jobs up to 100; 127 if the command cannot be found)
     """
-    
-    while True:
-        line = input("PShell>")
-        fields = line.split()
-    
-        if fields[0] == "files":
-            filesCmd(fields)
-        elif fields[0] == "info":
-            infoCmd(fields)
-        elif fields[0] == "delete":
-            deleteCmd(fields)
-        elif fields[0] == "copy":
-            copyCmd(fields)
-        elif fields[0] == "where":
-            whereCmd(fields)
-        elif fields[0] == "down":
-            downCmd(fields)
-        elif fields[0] == "up":
-            upCmd(fields)
-        elif fields[0] == "exit":
-            exitCmd(fields)
-        else:
-            runCmd(fields)
-    
-    return 0 # currently unreachable code
+
+    import selectors
+    try:
+        jobs, keepOrder, command, inputs = parseParallelArgs(fields)
+    except (ValueError, IndexError) as error:
+        print(Fore.RED + "ERROR - parallel: " + str(error) + Fore.WHITE)
+        return 1
+
+    execname = add_path(command[0], THE_PATH)
+    if execname is None:
+        print("Executable file", command[0], "not found")
+        return 127
+
+    def jobFields(value):
+        if any("{}" in field for field in command):
+            return [field.replace("{}", value) for field in command]
+        return command + [value]
+
+    selector = selectors.DefaultSelector()
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    running = 0
+    failed = 0
+    finished = {}       # job number -> (fields, status, output) waiting to be printed with -k
+    nextToPrint = 0
+
+    def report(number, argv, status, output):
+        sys.stdout.write(output.decode(errors="replace"))
+        sys.stdout.flush()
+        if status != 0:
+            sys.stderr.write("parallel: job " + str(number + 1) + " (" + " ".join(argv) + ") exited with status " + str(status) + "\n")
+
+    try:
+        pending = enumerate(inputs)
+        exhausted = False
+        while running or not exhausted:
+            while running < jobs and not exhausted:
+                try:
+                    number, value = next(pending)
+                except StopIteration:
+                    exhausted = True
+                    break
+                argv = jobFields(value)
+                readEnd, writeEnd = os.pipe()
+                try:
+                    pid = launchProgram(execname, argv, devnull, writeEnd, stderr=writeEnd)
+                except OSError as error:
+                    os.close(readEnd)
+                    finished[number] = (argv, 127, (error.strerror + "\n").encode())
+                    failed += 1
+                    continue
+                finally:
+                    os.close(writeEnd)
+                selector.register(readEnd, selectors.EVENT_READ, (number, argv, pid, []))
+                running += 1
+
+            for key, _ in selector.select() if running else ():
+                number, argv, pid, chunks = key.data
+                chunk = os.read(key.fd, 65536)
+                if chunk:
+                    chunks.append(chunk)
+                    continue
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                running -= 1
+                status = waitChild(pid)
+                if status != 0:
+                    failed += 1
+                finished[number] = (argv, status, b"".join(chunks))
+
+            for number in sorted(finished) if keepOrder else list(finished):
+                if keepOrder and number != nextToPrint:
+                    break
+                report(number, *finished.pop(number))
+                nextToPrint = number + 1
+    finally:
+        for key in list(selector.get_map().values()):
+            os.close(key.fd)
+            os.waitpid(key.data[2], 0)
+        selector.close()
+        os.close(devnull)
+    return min(failed, 100)
+
+# ========================
+#   files command
+#   List file and directory names
+#   files [-r] [-l] [-s] [pattern ...]
+#       -r recurse into sub directories, -l long listing (size and modification date),
+#       -s sort names, patterns are globs matched against each name
+# ========================
+def scanEntries(top, recursive=False, sort=False, errors=None):
+    """Yields (relative path, DirEntry) for every entry under directory top.
+
+    Input: takes a directory name, whether to descend into sub directories (symlinked
+           directories are not followed), whether to sort names within each directory and
+           an optional list that collects OSErrors from unreadable directories
+    Action: reads directories lazily with os.scandir so entries stream out as they are read;
+            only the stack of pending sub directories is kept (plus one directory's entries
+            when sorting)
+    Output: yields (path relative to top, os.DirEntry) pairs
+    """
+    pending = [""]
+    while pending:
+        relative = pending.pop()
+        try:
+            with os.scandir(os.path.join(top, relative) if relative else top) as it:
+                entries = sorted(it, key=lambda entry: entry.name) if sort else it
+                subdirs = []
+                for entry in entries:
+                    path = relative + entry.name
+                    yield path, entry
+                    if recursive:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(path + "/")
+                        except OSError:
+                            pass
+        except OSError as error:
+            if errors is not None:
+                errors.append(error)
+            continue
+        # reversed so that popping the stack visits sub directories in listing order
+        pending.extend(reversed(subdirs))
+
+
+def globMatcher(patterns):
+    """Returns a function telling whether a name matches any of the glob patterns (None if no patterns)."""
+    if not patterns:
+        return None
+    import fnmatch, re
+    return re.compile("|".join("(?:" + fnmatch.translate(pattern) + ")" for pattern in patterns)).match
+
+
+def listFiles(top=".", recursive=False, sort=False, patterns=None, details=False, errors=None):
+    """Yields one dictionary per entry under directory top (the data behind the files command).
+
+    Input: takes a directory name, whether to recurse and to sort (see scanEntries), glob
+           patterns the entry names must match, whether to add size and modification time,
+           and an optional list that collects OSErrors
+    Action: streams entries from scanEntries using the type cached in each DirEntry; only
+            with details is each entry stat'ed
+    Output: yields {"path", "type" ("dir" or "file")}, plus "size" and "mtime" with details
+    """
+    match = globMatcher(patterns)
+    for path, entry in scanEntries(top, recursive, sort, errors):
+        if match is not None and not match(entry.name):
+            continue
+        try:
+            record = {"path": path, "type": "dir" if entry.is_dir() else "file"}
+            if details:
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    info = entry.stat(follow_symlinks=False)    # dangling symlink
+                record["size"] = info.st_size
+                record["mtime"] = info.st_mtime
+        except OSError as error:
+            if errors is not None:
+                errors.append(error)
+            continue
+        yield record
+
+
+def renderFiles(records):
+    """Prints one line per record from listFiles (the long format when records have a size)."""
+    write = sys.stdout.write
+    for record in records:
+        kind = record["type"] + ":"
+        if "size" in record:
+            write(kind.ljust(5) + " " + str(record["size"]).rjust(12) + "  "
+                  + time.strftime(DATE_FORMAT, time.localtime(record["mtime"])) + "  " + record["path"] + "\n")
+        else:
+            write(kind + " " + record["path"] + "\n")
+
+
+def filesCmd(fields):
+    """Return nothing after printing names/types of files/dirs in working directory.
+    
+    Input: takes a list of text fields
+    Action: prints for each file/dir in current working directory their type and name as
+            os.scandir reads them (see listFiles and renderFiles);
+            options add recursion, glob filtering, sorting and a long format
+    Output: returns exit status (0 on success, 1 on error)
+    """
+    
+    try:
+        options, patterns = splitOptions(fields, "rls")
+    except ValueError as error:
+        print(error)
+        return 1
+    errors = []
+    renderFiles(listFiles('.', "-r" in options, "-s" in options, patterns, "-l" in options, errors))
+
+    for error in errors:
+        print(Fore.RED + "ERROR - " + str(error.filename) + ": " + error.strerror + Fore.WHITE)
+    return 1 if errors else 0
+
+# ========================
+#  info command
+#   List file information
+#   info [--json] name|glob ...
+#       --json prints one JSON object per file instead of the labelled listing
+# ========================
+DATE_FORMAT = '%b %d %Y %H:%M:%S'
+
+
+@functools.lru_cache(maxsize=None)
+def ownerName(uid):
+    """Returns the user name for uid (the number as text if it has no passwd entry), cached per uid."""
+    import pwd
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+@functools.lru_cache(maxsize=1)
+def processIds():
+    """Returns (real uid, set of group ids) of this process, as used by os.access."""
+    return os.getuid(), set(os.getgroups()) | {os.getgid()}
+
+
+def canExecute(info):
+    """Returns whether this process may execute (or search) the file described by stat result info.
+
+    Mirrors os.access(X_OK) from the permission bits, so no extra system call is needed.
+    """
+    mode = info.st_mode
+    uid, groups = processIds()
+    if uid == 0:
+        return bool(mode & 0o111) or stat.S_ISDIR(mode)
+    if info.st_uid == uid:
+        return bool(mode & stat.S_IXUSR)
+    if info.st_gid in groups:
+        return bool(mode & stat.S_IXGRP)
+    return bool(mode & stat.S_IXOTH)
+
+
+def statRecord(filename):
+    """Returns a dictionary of information about filename, from a single os.stat call.
+
+    Input: takes a file name
+    Action: stats the file once and derives every field from that stat result, so the
+            fields are consistent even if the file changes meanwhile
+    Output: returns dictionary with name, owner, type ("dir", "file" or "other"), size,
+            atime, ctime, mtime (seconds since the epoch), mode and executable
+            (raises OSError if the file cannot be stat'ed)
+    """
+    info = os.stat(filename)
+    mode = info.st_mode
+    return {
+        "name": filename,
+        "owner": ownerName(info.st_uid),
+        "type": "dir" if stat.S_ISDIR(mode) else "file" if stat.S_ISREG(mode) else "other",
+        "size": info.st_size,
+        "atime": info.st_atime,
+        "ctime": info.st_ctime,
+        "mtime": info.st_mtime,
+        "mode": oct(stat.S_IMODE(mode)),
+        "executable": canExecute(info),
+    }
+
+
+def expandGlobs(names):
+    """Yields the file names matching each of names (names without wildcards are yielded as given).
+
+    A pattern that matches nothing is yielded unchanged so the caller reports it as missing.
+    """
+    import glob
+    for name in names:
+        if glob.has_magic(name):
+            matches = sorted(glob.iglob(name))
+            yield from matches or [name]
+        else:
+            yield name
+
+
+def fileInfo(names):
+    """Yields statRecord(name) for every file name or glob in names (the data behind the info command).
+
+    A name that cannot be stat'ed yields {"name": name, "error": reason} instead.
+    """
+    for filename in expandGlobs(names):
+        try:
+            yield statRecord(filename)
+        except OSError as error:
+            yield {"name": filename, "error": error.strerror}
+
+
+def renderInfo(records, asJson=False):
+    """Returns exit status (1 if any record is an error) after printing records from fileInfo.
+
+    Input: takes records from fileInfo and whether to print one JSON object per line
+    Action: prints the labelled listing (or JSON) of each record
+    Output: returns exit status (0 on success, 1 if any file could not be found)
+    """
+    if asJson:
+        import json
+
+    status = 0
+    first = True
+    for record in records:
+        filename = record["name"]
+        if "error" in record:
+            status = 1
+            if asJson:
+                print(json.dumps(record))
+            else:
+                print(Fore.RED + "ERROR  - No file named: "+filename + Fore.WHITE)
+            continue
+
+        if asJson:
+            print(json.dumps(record))
+            continue
+        if not first:
+            print()
+        first = False
+        print(Fore.BLUE + 'Name: ' + Fore.WHITE + filename)
+        print(Fore.BLUE + "Owner: " +Fore.WHITE + record["owner"])
+
+        #determine dir or file type.
+        if record["type"] == "dir":
+            print(Fore.BLUE + "Type: " +Fore.WHITE +"Dir")
+        else:
+            #Print extra info
+            print(Fore.BLUE + "Type: " +Fore.WHITE +"File")
+            print(Fore.BLUE + 'Size (Bytes): ' + Fore.WHITE + str(record["size"]))
+            print(Fore.BLUE + 'Date of last access: ' +Fore.WHITE + time.strftime(DATE_FORMAT, time.localtime(record["atime"])))
+            print(Fore.BLUE + 'Date of last access permissions modification: ' +Fore.WHITE + time.strftime(DATE_FORMAT, time.localtime(record["ctime"])))
+
+        print(Fore.BLUE + 'Date of last modification: ' +Fore.WHITE + time.strftime(DATE_FORMAT, time.localtime(record["mtime"])))
+        print(Fore.BLUE + "Executable? : " +Fore.WHITE + str(record["executable"]))
+    return status
+
+
+def infoCmd(fields):
+    """Return nothing after printing basic file information about target files.
+    
+    Input: takes a list of text fields
+    Action: prints our the name, owner, file/dir status, size (bytes), date of last access, date of last permissions mod, date of last
+    modification and if the program can be executed or not, for every file name or glob given.
+    With --json each file is printed as one JSON object per line instead.
+    Output: returns exit status (0 on success, 1 if any file could not be found)
+    """
+
+    names = [field for field in fields[1:] if field != "--json"]
+    if not names:
+        print("Missing argument for command", fields[0])
+        return 1
+    return renderInfo(fileInfo(names), len(names) != len(fields) - 1)
+            
+
+# ====================================================
+#  Delete command, allows removal of file from system
+#       Deletes target files, provided they exist.
+#       delete [-r] [-j N] name|glob ...
+#           -r also removes directories and everything in them, -j spreads the
+#           top-level sub directories of each tree over N threads
+#=====================================================
+
+def removeTreeAt(dirfd, name):
+    """Returns (files, dirs, bytes, errors) after removing directory name and everything in it.
+
+    Input: takes an open directory fd (or None for the working directory) and a directory
+           name relative to it
+    Action: opens the directory once (without following symlinks) and unlinks every entry
+            through that fd with dir_fd, so no path is resolved again from the root
+    Output: returns counts of files and directories removed, bytes freed and error messages
+    """
+    files = dirs = size = 0
+    errors = []
+    try:
+        fd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=dirfd)
+    except OSError as error:
+        return 0, 0, 0, [name + ": " + error.strerror]
+    try:
+        with os.scandir(fd) as it:
+            entries = list(it)
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    counts = removeTreeAt(fd, entry.name)
+                    files, dirs, size = files + counts[0], dirs + counts[1], size + counts[2]
+                    errors.extend(name + "/" + error for error in counts[3])
+                else:
+                    length = entry.stat(follow_symlinks=False).st_size
+                    os.unlink(entry.name, dir_fd=fd)
+                    files += 1
+                    size += length
+            except OSError as error:
+                errors.append(name + "/" + entry.name + ": " + error.strerror)
+    finally:
+        os.close(fd)
+    try:
+        os.rmdir(name, dir_fd=dirfd)
+        dirs += 1
+    except OSError as error:
+        if not errors:
+            errors.append(name + ": " + error.strerror)
+    return files, dirs, size, errors
+
+
+def removeTreeParallel(path, workers):
+    """Returns (files, dirs, bytes, errors) after removing directory path with a thread pool.
+
+    The top-level sub directories of path are removed concurrently by removeTreeAt; files
+    directly inside path are unlinked by the calling thread.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    total = [0, 0, 0, []]
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+    except OSError as error:
+        return 0, 0, 0, [path + ": " + error.strerror]
+    try:
+        with os.scandir(fd) as it:
+            entries = list(it)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        futures.append(pool.submit(removeTreeAt, fd, entry.name))
+                    else:
+                        length = entry.stat(follow_symlinks=False).st_size
+                        os.unlink(entry.name, dir_fd=fd)
+                        total[0] += 1
+                        total[2] += length
+                except OSError as error:
+                    total[3].append(entry.name + ": " + error.strerror)
+            for future in futures:
+                files, dirs, size, errors = future.result()
+                total[0] += files
+                total[1] += dirs
+                total[2] += size
+                total[3].extend(errors)
+    finally:
+        os.close(fd)
+    try:
+        os.rmdir(path)
+        total[1] += 1
+    except OSError as error:
+        if not total[3]:
+            total[3].append(path + ": " + error.strerror)
+    total[3] = [error if error.startswith(path) else os.path.join(path, error) for error in total[3]]
+    return tuple(total)
+
+
+def deleteFiles(names, recursive=False, workers=1):
+    """Returns a dictionary describing the removal of every named file (the data behind the delete command).
+
+    Input: takes file names or globs, whether directories may be removed and the number of
+           threads per directory tree
+    Action: deletes every named file with a single unlink each; with recursive, directories
+            are removed through directory fds (see removeTreeAt and removeTreeParallel)
+    Output: returns {"targets", "files", "dirs", "bytes", "seconds", "recursive", "errors"},
+            errors being a list of messages
+    """
+    start = time.perf_counter()
+    files = dirs = size = 0
+    errors = []
+    targets = 0
+    for filename in expandGlobs(names):
+        targets += 1
+        if os.path.basename(filename.rstrip('/')) in ('', '.', '..'):
+            errors.append(filename + ": refusing to remove")
+            continue
+        try:
+            length = os.lstat(filename).st_size
+            os.unlink(filename)
+            files += 1
+            size += length
+        except FileNotFoundError:
+            errors.append(filename + ": File not found. Perhaps check your working directory?")
+        except IsADirectoryError:
+            if not recursive:
+                errors.append(filename + ": Target is not a file, is Dir")
+                continue
+            if workers > 1:
+                counts = removeTreeParallel(filename, workers)
+            else:
+                counts = removeTreeAt(None, filename)
+            files, dirs, size = files + counts[0], dirs + counts[1], size + counts[2]
+            errors.extend(counts[3])
+        except OSError as error:
+            errors.append(filename + ": " + error.strerror)
+    return {"targets": targets, "files": files, "dirs": dirs, "bytes": size,
+            "seconds": time.perf_counter() - start, "recursive": recursive, "errors": errors}
+
+
+def renderDelete(result):
+    """Returns exit status (1 if there were errors) after printing a result from deleteFiles.
+
+    A single non-recursive target gets a short message, anything else a summary of the
+    files, bytes and time reclaimed.
+    """
+    for error in result["errors"]:
+        print(Fore.RED + "ERROR - " + error + Fore.WHITE)
+    if result["targets"] == 1 and not result["recursive"]:
+        if result["files"]:
+            print(Fore.BLUE + "File Removed." + Fore.WHITE)
+    else:
+        print(Fore.BLUE + "Removed " + str(result["files"]) + " files and " + str(result["dirs"]) + " directories, "
+              + formatSize(result["bytes"]) + " reclaimed in " + "%.3f" % result["seconds"] + " s" + Fore.WHITE)
+    return 1 if result["errors"] else 0
+
+
+def deleteCmd(fields):
+
+    """Return nothing after pdeleting the target files. If a filename cannot be found, throw error
+    
+    Input: takes a list of text fields
+    Action: deletes every named file (glob patterns are expanded) with a single unlink each;
+            with -r directories are removed recursively through directory fds, spread over
+            -j threads. Prints a success message, or a summary of the files, bytes and time
+            reclaimed when more than one target or -r is given.
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    try:
+        options, names = splitOptions(fields, "r", "j")
+        workers = int(options.get("-j", 1))
+    except ValueError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        return 1
+    if not names:
+        print("Missing argument for command", fields[0])
+        return 1
+    return renderDelete(deleteFiles(names, "-r" in options, workers))
+
+
+# ====================================================
+#  Copy command, allows duplication of a selected file to a targeted name
+#       Duplucates soruce file, provided name of dest file does not exist
+#       copy [-r] [-p] [-v] [-j N] src dest
+#           -r copies a directory tree using N worker threads (default: CPU count),
+#           -p preserves permissions and times, -v shows progress while copying
+#=====================================================
+FICLONE = 0x40049409            # ioctl request for a reflink (copy-on-write clone) on Linux
+COPY_CHUNK = 1024 * 1024 * 1024 # bytes per copy_file_range/sendfile call
+BUFFER_SIZE = 1024 * 1024       # buffer for the plain read/write fallback
+
+
+class CopyProgress:
+    """Thread-safe byte and file counters for one copy, optionally printing progress to stderr."""
+
+    def __init__(self, total=None, verbose=False):
+        import threading
+        self.lock = threading.Lock()
+        self.total = total
+        self.verbose = verbose
+        self.bytes = 0
+        self.files = 0
+        self.start = time.perf_counter()
+        self.shown = self.start
+
+    def add(self, count):
+        """Records count more bytes copied (shows progress at most every half second)."""
+        with self.lock:
+            self.bytes += count
+            now = time.perf_counter()
+            if self.verbose and now - self.shown >= 0.5:
+                self.shown = now
+                sys.stderr.write("\r" + self.describe(now) + "   ")
+                sys.stderr.flush()
+
+    def describe(self, now=None):
+        """Returns e.g. "45% 1.2 GB 310.5 MB/s" for the bytes copied so far."""
+        elapsed = max((now or time.perf_counter()) - self.start, 1e-9)
+        text = formatSize(self.bytes) + " " + formatSize(self.bytes / elapsed) + "/s"
+        if self.total:
+            text = str(int(100 * self.bytes / self.total)) + "% " + text
+        return text
+
+
+def formatSize(count):
+    """Returns a byte count as text with a binary unit, e.g. "1.5 MB"."""
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if count < 1024 or unit == "TB":
+            return ("%d %s" if unit == "B" else "%.1f %s") % (count, unit)
+        count /= 1024
+
+
+def copyFileData(fromFile, toFile, progress=None):
+    """Returns the name of the method used after copying the contents of fromFile to toFile.
+
+    Input: takes source and destination file names and an optional CopyProgress
+    Action: tries, in order, a reflink clone (no data copied at all), os.copy_file_range and
+            os.sendfile (data stays inside the kernel), then a large-buffer read/write loop
+    Output: returns "reflink", "copy_file_range", "sendfile" or "buffered"
+    """
+    import fcntl
+    # errors meaning "this method is not available here", after which the next one is tried
+    unsupported = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM)
+    report = progress.add if progress is not None else (lambda count: None)
+
+    with open(fromFile, 'rb') as source, open(toFile, 'wb') as dest:
+        infd, outfd = source.fileno(), dest.fileno()
+        size = os.fstat(infd).st_size
+        try:
+            fcntl.ioctl(outfd, FICLONE, infd)
+            report(size)
+            return "reflink"
+        except OSError:
+            pass
+
+        for method in ("copy_file_range", "sendfile"):
+            if not hasattr(os, method):
+                continue
+            copied = 0
+            try:
+                while True:
+                    if method == "sendfile":
+                        sent = os.sendfile(outfd, infd, None, COPY_CHUNK)
+                    else:
+                        sent = os.copy_file_range(infd, outfd, COPY_CHUNK)
+                    if sent == 0:
+                        return method
+                    copied += sent
+                    report(sent)
+            except OSError as error:
+                # only fall back when nothing was written, so the file offsets are still at 0
+                if copied or error.errno not in unsupported:
+                    raise
+
+        buffer = bytearray(BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                return "buffered"
+            dest.write(view[:count])
+            report(count)
+
+
+def copyTree(fromDir, toDir, workers, preserve, progress):
+    """Returns a list of error messages after copying directory fromDir to a new directory toDir.
+
+    Input: takes source and (not yet existing) destination directories, the number of worker
+           threads, whether to preserve metadata and a CopyProgress
+    Action: walks fromDir with scanEntries, creating directories and symlinks as they are
+            met and handing regular files to a thread pool; with preserve, directory
+            metadata is applied last, deepest first, so copying files does not reset it
+    Output: returns list of error messages (empty when everything was copied)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import shutil
+    errors = []
+    walkErrors = []
+    directories = [""]
+    os.mkdir(toDir)
+
+    def copyOne(source, dest):
+        copyFileData(source, dest, progress)
+        if preserve:
+            shutil.copystat(source, dest)
+        with progress.lock:
+            progress.files += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for path, entry in scanEntries(fromDir, recursive=True, errors=walkErrors):
+            source = os.path.join(fromDir, path)
+            dest = os.path.join(toDir, path)
+            try:
+                if entry.is_symlink():
+                    os.symlink(os.readlink(source), dest)
+                elif entry.is_dir():
+                    os.mkdir(dest)
+                    directories.append(path)
+                else:
+                    futures.append((source, pool.submit(copyOne, source, dest)))
+            except OSError as error:
+                errors.append(source + ": " + error.strerror)
+        for source, future in futures:
+            try:
+                future.result()
+            except OSError as error:
+                errors.append(source + ": " + error.strerror)
+
+    if preserve:
+        for path in reversed(directories):
+            shutil.copystat(os.path.join(fromDir, path), os.path.join(toDir, path))
+    return errors + [str(error.filename) + ": " + error.strerror for error in walkErrors]
+
+
+def copyFiles(fromFile, toFile, recursive=False, preserve=False, workers=None, verbose=False):
+    """Returns a dictionary describing the copy of fromFile to toFile (the data behind the copy command).
+
+    Input: takes source and (not yet existing) destination names, whether a directory source
+           may be copied, whether to preserve permissions and times, the number of threads
+           for a tree (default: CPU count) and whether to show progress on stderr
+    Action: copies one file with copyFileData, or a directory with copyTree
+    Output: returns {"method", "files", "bytes", "seconds", "errors"}; method is what
+            copyFileData used, "tree" for a directory, or None if nothing was copied
+    """
+    result = {"method": None, "files": 0, "bytes": 0, "seconds": 0.0, "errors": []}
+    if not os.path.exists(fromFile) or os.path.lexists(toFile):
+        result["errors"].append("Source file either does not exist or destination file already exists.")
+        return result
+    isTree = os.path.isdir(fromFile)
+    if isTree and not recursive:
+        result["errors"].append("Source is a directory, use copy -r to copy it.")
+        return result
+
+    progress = CopyProgress(None if isTree else os.path.getsize(fromFile), verbose)
+    try:
+        if isTree:
+            result["errors"] = copyTree(fromFile, toFile, max(workers or cpuCount(), 1), preserve, progress)
+            result["method"] = "tree"
+        else:
+            result["method"] = copyFileData(fromFile, toFile, progress)
+            if preserve:
+                import shutil
+                shutil.copystat(fromFile, toFile)
+            progress.files = 1
+    except OSError as error:
+        result["errors"] = [str(error.filename) + ": " + error.strerror]
+        result["method"] = None
+    if progress.verbose:
+        sys.stderr.write("\r")
+    result["files"], result["bytes"] = progress.files, progress.bytes
+    result["seconds"] = time.perf_counter() - progress.start
+    return result
+
+
+def renderCopy(result):
+    """Returns exit status (1 if there were errors) after printing a result from copyFiles."""
+    for error in result["errors"]:
+        print(Fore.RED + "ERROR - " + error + Fore.WHITE)
+    if result["method"] is None:
+        return 1
+    method = str(result["files"]) + " files" if result["method"] == "tree" else result["method"]
+    rate = result["bytes"] / max(result["seconds"], 1e-9)
+    print(Fore.BLUE + "File Copied successfully. " + Fore.WHITE + "("
+          + formatSize(result["bytes"]) + " " + formatSize(rate) + "/s, " + method + ")")
+    return 1 if result["errors"] else 0
+
+
+def copyCmd(fields):
+
+    """Return nothing after duplicating the target file. If src filename cannot be found, throw error. if DEST already exists, throw error
+    
+    Input: takes a list of text fields
+    Action: duplicates a target into filename of DEST using the fastest copy the kernel and
+            file system offer (see copyFileData); -r copies whole directory trees in parallel,
+            -p keeps permissions and times, -v reports progress
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    try:
+        options, names = splitOptions(fields, "rpv", "j")
+        workers = int(options.get("-j", cpuCount()))
+    except ValueError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        return 1
+    if not checkArgs([fields[0]] + names, 2):
+        return 1
+    return renderCopy(copyFiles(names[0], names[1], "-r" in options, "-p" in options, workers, "-v" in options))
+
+
+# ====================================================
+#  Usage command (also "du"), shows how much space directory trees take
+#       usage [-d N] [-j N] [-s] [-f] [-v] [dir ...]
+#           -d lists directories down to N levels below each dir (default 1),
+#           -j walks with N threads, -s sorts by size (largest first),
+#           -f ignores (and refreshes) the cache, -v reports directories read and cached
+#  Each directory's own file bytes and sub directory names are cached on disk under its
+#  (device, inode) together with its mtime, so a repeat scan lists only the directories
+#  whose entries changed and merely stats the others. A file rewritten in place does not
+#  change its directory's mtime, so its new size is only seen after that directory
+#  changes, or with -f. Sizes are apparent sizes (st_size) and a file with several hard
+#  links is counted once per link.
+#=====================================================
+class JsonCache:
+    """A dictionary kept in one JSON file: loaded on first use, written back only when changed.
+
+    A path of "off" keeps the cache in memory only. Writers set dirty after changing entries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+        self.dirty = False
+
+    def load(self):
+        """Returns the cached dictionary, reading the file on first use."""
+        if self.entries is None:
+            self.entries = {}
+            if self.path != "off":
+                import json
+                try:
+                    with open(self.path) as cache:
+                        self.entries = json.load(cache)
+                except (OSError, ValueError):
+                    pass    # no cache yet, or a damaged one that the next save replaces
+        return self.entries
+
+    def save(self):
+        """Writes the dictionary back to the file (atomically, through a rename) if it changed."""
+        if self.path == "off" or not self.dirty:
+            return
+        import json
+        temp = self.path + "." + str(os.getpid())
+        try:
+            with open(temp, "w") as cache:
+                json.dump(self.entries, cache, separators=(",", ":"))
+            os.replace(temp, self.path)
+            self.dirty = False
+        except OSError as error:
+            print(Fore.RED + "ERROR - Cannot save cache " + self.path + ": " + error.strerror + Fore.WHITE)
+
+
+# "dev:ino" of a directory -> [mtime_ns, file bytes, [sub directory names]]
+USAGE_CACHE = JsonCache(os.environ.get("PSHELL_USAGE_CACHE", os.path.join(os.path.expanduser("~"), ".pshell_usage_cache")))
+
+
+def usageKey(info):
+    """Returns the cache key of the directory described by stat result info."""
+    return str(info.st_dev) + ":" + str(info.st_ino)
+
+
+def scanUsageDir(path, key, mtime, fresh):
+    """Returns (file bytes, [(sub directory, key, mtime_ns)], listed) for one directory.
+
+    Input: takes a directory path, its cache key and mtime_ns, and whether to skip the cache
+    Action: when the cache holds this directory at this mtime, only its sub directories are
+            lstat'ed; otherwise it is listed with os.scandir (every entry lstat'ed once) and
+            the cache entry is replaced
+    Output: returns bytes of the files directly inside path, its sub directories (symlinks
+            are not followed) and whether it had to be listed
+            (raises OSError if it cannot be read)
+    """
+    cache = USAGE_CACHE.entries
+    cached = None if fresh else cache.get(key)
+    subdirs = []
+    if cached is not None and cached[0] == mtime:
+        for name in cached[2]:
+            child = os.path.join(path, name)
+            try:
+                info = os.lstat(child)
+            except OSError:
+                continue
+            if stat.S_ISDIR(info.st_mode):
+                subdirs.append((child, usageKey(info), info.st_mtime_ns))
+        return cached[1], subdirs, False
+
+    size = 0
+    names = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                info = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.S_ISDIR(info.st_mode):
+                names.append(entry.name)
+                subdirs.append((entry.path, usageKey(info), info.st_mtime_ns))
+            else:
+                size += info.st_size
+    cache[key] = [mtime, size, names]
+    USAGE_CACHE.dirty = True
+    return size, subdirs, True
+
+
+def diskUsage(top, workers=None, fresh=False, errors=None):
+    """Returns ({directory: total bytes}, counts) for every directory in the tree under top.
+
+    Input: takes a directory name, the number of threads (None: ThreadPoolExecutor's default),
+           whether to bypass the cache and an optional list that collects error messages
+    Action: hands each directory to a thread pool as soon as its parent has been read (see
+            scanUsageDir), then adds up the totals from the deepest directories upwards
+    Output: returns dictionary of directory path (top included) -> bytes of all files below it,
+            and {"listed": directories read with scandir, "cached": directories from the cache}
+            (raises OSError if top cannot be stat'ed)
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    top = os.path.normpath(top)
+    info = os.stat(top)
+    USAGE_CACHE.load()
+    direct, children = {}, {}
+    counts = {"listed": 0, "cached": 0}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(scanUsageDir, top, usageKey(info), info.st_mtime_ns, fresh): top}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    size, subdirs, listed = future.result()
+                except OSError as error:
+                    if errors is not None:
+                        errors.append(path + ": " + error.strerror)
+                    size, subdirs, listed = 0, [], True
+                counts["listed" if listed else "cached"] += 1
+                direct[path] = size
+                children[path] = [subdir for subdir, _, _ in subdirs]
+                for subdir, key, mtime in subdirs:
+                    pending[pool.submit(scanUsageDir, subdir, key, mtime, fresh)] = subdir
+
+    # post-order walk: a directory's total is added up once all its children have theirs
+    totals = {}
+    stack = [(top, False)]
+    while stack:
+        path, expanded = stack.pop()
+        if expanded:
+            totals[path] = direct[path] + sum(totals[child] for child in children[path])
+        else:
+            stack.append((path, True))
+            stack.extend((child, False) for child in children[path])
+    return totals, counts
+
+
+def renderUsage(top, totals, depth=1, bySize=False):
+    """Prints the size of every directory in totals down to depth levels below top."""
+    top = os.path.normpath(top)
+
+    def level(path):
+        relative = os.path.relpath(path, top)
+        return 0 if relative == "." else relative.count(os.sep) + 1
+
+    paths = [path for path in totals if level(path) <= depth]
+    paths.sort(key=lambda path: -totals[path] if bySize else path)
+    for path in paths:
+        print(formatSize(totals[path]).rjust(10) + "  " + path)
+
+
+def usageCmd(fields):
+    """Returns exit status after printing the space taken by each directory tree named.
+
+    Input: takes a list of text fields
+    Action: sums the sizes of all files under each directory (default: the working
+            directory) with a threaded, cached walk (see diskUsage) and prints the totals
+            of the directories down to -d levels, then saves the cache
+    Output: returns exit status (0 on success, 1 on error)
+    """
+    try:
+        options, tops = splitOptions(fields, "sfv", "dj")
+        depth = int(options.get("-d", 1))
+        workers = max(int(options["-j"]), 1) if "-j" in options else None
+    except ValueError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        return 1
+
+    status = 0
+    for top in tops or ["."]:
+        start = time.perf_counter()
+        errors = []
+        try:
+            totals, counts = diskUsage(top, workers, "-f" in options, errors)
+        except OSError as error:
+            print(Fore.RED + "ERROR - " + top + ": " + error.strerror + Fore.WHITE)
+            status = 1
+            continue
+        renderUsage(top, totals, depth, "-s" in options)
+        for error in errors:
+            print(Fore.RED + "ERROR - " + error + Fore.WHITE)
+            status = 1
+        if "-v" in options:
+            print(Fore.BLUE + str(counts["listed"]) + " directories read, " + str(counts["cached"])
+                  + " from the cache in " + "%.3f" % (time.perf_counter() - start) + " s" + Fore.WHITE)
+    USAGE_CACHE.save()
+    return status
+
+
+# ====================================================
+#  Sync command, makes dst an up-to-date copy of src, copying only what changed
+#       sync [-c] [-n] [-v] [-j N] src dst
+#           -c compares every same-sized file by freshly read content, -n only reports what would be
+#           copied, -v lists the files copied, -j uses N threads (default: CPU count)
+#  A file whose size and mtime match is taken as unchanged; same size with a different
+#  mtime is settled by comparing blake2b hashes read in chunks. Hashes are cached on disk
+#  under (device, inode) with the size and mtime they were taken at, so repeat syncs of a
+#  large tree only hash files that changed. Changed files are copied in parallel to a
+#  temporary name and renamed into place with the source's mode and mtime.
+#=====================================================
+HASH_CHUNK = 1024 * 1024
+# "dev:ino" of a file -> [size, mtime_ns, blake2b hex digest]
+HASH_CACHE = JsonCache(os.environ.get("PSHELL_HASH_CACHE", os.path.join(os.path.expanduser("~"), ".pshell_hash_cache")))
+
+
+def fileHash(path, info, fresh=False):
+    """Returns the blake2b hex digest of file path, whose lstat result is info.
+
+    The digest comes from HASH_CACHE while size and mtime still match, unless fresh is set;
+    a digest that had to be computed is stored there.
+    """
+    key = usageKey(info)
+    cache = HASH_CACHE.load()
+    cached = None if fresh else cache.get(key)
+    if cached is not None and cached[0] == info.st_size and cached[1] == info.st_mtime_ns:
+        return cached[2]
+    import hashlib
+    digest = hashlib.blake2b()
+    buffer = bytearray(HASH_CHUNK)
+    view = memoryview(buffer)
+    with open(path, "rb") as file:
+        while True:
+            count = file.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    cache[key] = [info.st_size, info.st_mtime_ns, digest.hexdigest()]
+    HASH_CACHE.dirty = True
+    return cache[key][2]
+
+
+def syncFile(source, dest, info, checksum=False, dryRun=False):
+    """Returns (action, bytes copied) after bringing file dest up to date with file source.
+
+    Input: takes source and destination names, the source's lstat result, whether to
+           compare contents even when size and mtime match, and whether to only report
+    Action: compares size and mtime, then (if still ambiguous) cached content hashes; a
+            changed file is copied with copyFileData to a temporary name beside dest, given
+            the source's mode and times, and renamed over dest
+    Output: returns "unchanged", "hashed" (equal by content) or "copied", and the bytes
+            copied (raises OSError)
+    """
+    try:
+        target = os.lstat(dest)
+    except (FileNotFoundError, NotADirectoryError):
+        target = None
+    if target is not None and stat.S_ISREG(target.st_mode) and target.st_size == info.st_size:
+        if target.st_mtime_ns == info.st_mtime_ns and not checksum:
+            return "unchanged", 0
+        if fileHash(source, info, checksum) == fileHash(dest, target, checksum):
+            if not dryRun and target.st_mtime_ns != info.st_mtime_ns:
+                os.utime(dest, ns=(info.st_atime_ns, info.st_mtime_ns))
+            return "hashed", 0
+    if dryRun:
+        return "copied", info.st_size
+
+    head, tail = os.path.split(dest)
+    temp = os.path.join(head, "." + tail + ".sync" + str(os.getpid()))
+    try:
+        copyFileData(source, temp)
+        os.chmod(temp, stat.S_IMODE(info.st_mode))
+        os.utime(temp, ns=(info.st_atime_ns, info.st_mtime_ns))
+        os.replace(temp, dest)
+    except OSError:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+    return "copied", info.st_size
+
+
+def syncTree(source, dest, workers=None, checksum=False, dryRun=False):
+    """Returns a dictionary describing the sync of source to dest (the data behind the sync command).
+
+    Input: takes a source file or directory, the destination, the number of threads,
+           whether to compare every same-sized file by content and whether to only report
+    Action: walks source with scanEntries, creating directories and symlinks in dest as they
+            are met and handing each regular file to syncFile on a thread pool; other file
+            types are skipped. The hash cache is saved at the end.
+    Output: returns {"copied": [paths relative to source], "unchanged", "hashed", "bytes",
+            "seconds", "errors": [messages]}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    start = time.perf_counter()
+    result = {"copied": [], "unchanged": 0, "hashed": 0, "bytes": 0, "seconds": 0.0, "errors": []}
+    HASH_CACHE.load()
+    isTree = os.path.isdir(source)
+    if isTree:
+        inside = os.path.realpath(dest) + "/"
+        if inside.startswith(os.path.realpath(source) + "/"):
+            result["errors"].append(dest + ": destination is inside the source")
+            return result
+    elif os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source))
+
+    walkErrors = []
+    with ThreadPoolExecutor(max_workers=workers or cpuCount()) as pool:
+        futures = []
+        if not isTree:
+            futures.append((os.path.basename(source), pool.submit(syncFile, source, dest, os.stat(source), checksum, dryRun)))
+        else:
+            if not dryRun and not os.path.isdir(dest):
+                os.makedirs(dest)
+            for path, entry in scanEntries(source, recursive=True, errors=walkErrors):
+                sourcePath, destPath = os.path.join(source, path), os.path.join(dest, path)
+                try:
+                    if entry.is_symlink():
+                        link = os.readlink(sourcePath)
+                        try:
+                            same = os.readlink(destPath) == link
+                        except OSError:
+                            same = False
+                        if same:
+                            result["unchanged"] += 1
+                            continue
+                        if not dryRun:
+                            if os.path.lexists(destPath):
+                                os.unlink(destPath)
+                            os.symlink(link, destPath)
+                        result["copied"].append(path)
+                    elif entry.is_dir():
+                        if not dryRun and not os.path.isdir(destPath):
+                            os.mkdir(destPath)
+                    elif entry.is_file():
+                        futures.append((path, pool.submit(syncFile, sourcePath, destPath,
+                                                          entry.stat(follow_symlinks=False), checksum, dryRun)))
+                except OSError as error:
+                    result["errors"].append(sourcePath + ": " + error.strerror)
+
+        for path, future in futures:
+            try:
+                action, size = future.result()
+            except OSError as error:
+                result["errors"].append(str(error.filename) + ": " + error.strerror)
+                continue
+            if action == "copied":
+                result["copied"].append(path)
+                result["bytes"] += size
+            else:
+                result[action] += 1
+
+    HASH_CACHE.save()
+    result["errors"].extend(str(error.filename) + ": " + error.strerror for error in walkErrors)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def renderSync(result, verbose=False, dryRun=False):
+    """Returns exit status (1 if there were errors) after printing a result from syncTree."""
+    if verbose or dryRun:
+        for path in sorted(result["copied"]):
+            print(("would copy: " if dryRun else "copied: ") + path)
+    for error in result["errors"]:
+        print(Fore.RED + "ERROR - " + error + Fore.WHITE)
+    print(Fore.BLUE + ("Would copy " if dryRun else "Synced: copied ") + str(len(result["copied"])) + " files ("
+          + formatSize(result["bytes"]) + "), " + str(result["unchanged"] + result["hashed"]) + " unchanged ("
+          + str(result["hashed"]) + " compared by hash) in " + "%.3f" % result["seconds"] + " s" + Fore.WHITE)
+    return 1 if result["errors"] else 0
+
+
+def syncCmd(fields):
+    """Returns exit status after making dst an up-to-date copy of src.
+
+    Input: takes a list of text fields
+    Action: copies the files of src (a file or a directory tree) that are missing or
+            different in dst, leaving identical ones alone (see syncTree)
+    Output: returns exit status (0 on success, 1 on error)
+    """
+    try:
+        options, names = splitOptions(fields, "cnv", "j")
+        workers = int(options["-j"]) if "-j" in options else None
+    except ValueError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        return 1
+    if not checkArgs([fields[0]] + names, 2):
+        return 1
+    if not os.path.exists(names[0]):
+        print(Fore.RED + "ERROR - " + names[0] + ": No such file or directory" + Fore.WHITE)
+        return 1
+    try:
+        result = syncTree(names[0], names[1], workers, "-c" in options, "-n" in options)
+    except OSError as error:
+        print(Fore.RED + "ERROR - " + str(error.filename) + ": " + error.strerror + Fore.WHITE)
+        return 1
+    return renderSync(result, "-v" in options, "-n" in options)
+
+
+# ====================================================
+#  Search command, finds lines matching a regular expression in files
+#       search [-i] [-F] [-l] [-j N] [-m MB] pattern [path ...]
+#           searches every regular file under each path (default: the working directory);
+#           -i ignores case, -F takes pattern as plain text, -l prints only file names,
+#           -j uses N worker processes (default: CPU count), -m skips files over MB megabytes
+#  Files are memory-mapped and scanned by one compiled bytes regex per worker process while
+#  the directory walk (scanEntries) keeps feeding the pool; matches print as each file
+#  finishes. Binary files (a NUL byte near the start) are skipped, and small file sets are
+#  searched in-process to avoid starting the pool.
+#  Exit status: 0 if a line matched, 1 if none did, 2 if a file could not be read.
+#=====================================================
+SEARCH_MAX_MB = 256         # default -m: larger files are skipped
+SEARCH_PROBE = 8192         # a NUL byte in this many leading bytes marks a file as binary
+SEARCH_INLINE = 32          # fewer candidate files than this are searched without a pool
+SEARCH_STATE = {"regex": None, "listOnly": False, "maxSize": 0}    # set in each process by searchInit
+
+
+def searchInit(pattern, flags, listOnly, maxSize):
+    """Compiles the search pattern once per process (the Pool initializer)."""
+    import re
+    SEARCH_STATE.update(regex=re.compile(pattern, flags), listOnly=listOnly, maxSize=maxSize)
+
+
+def searchFile(path):
+    """Returns (path, [(line number, line bytes), ...], error message or None) for one file.
+
+    Input: takes a file name (searchInit must have run in this process)
+    Action: skips empty, binary and oversized files, memory-maps the rest and runs the
+            regex over the mapping, reporting each matching line once; line numbers come
+            from counting newlines only up to each match
+    Output: returns the file name, its matching lines (just the first with -l) and an error
+    """
+    import mmap
+    regex = SEARCH_STATE["regex"]
+    matches = []
+    try:
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0 or size > SEARCH_STATE["maxSize"] or b"\0" in file.read(SEARCH_PROBE):
+                return path, matches, None
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                position = counted = 0
+                lineno = 1
+                while position <= size:
+                    match = regex.search(data, position)
+                    if match is None:
+                        break
+                    start = data.rfind(b"\n", 0, match.start()) + 1
+                    end = data.find(b"\n", max(match.end(), start))
+                    if end < 0:
+                        end = size
+                    lineno += data[counted:start].count(b"\n")
+                    counted = start
+                    matches.append((lineno, data[start:end]))
+                    if SEARCH_STATE["listOnly"]:
+                        break
+                    position = end + 1
+    except (OSError, ValueError) as error:
+        return path, matches, getattr(error, "strerror", None) or str(error)
+    return path, matches, None
+
+
+def searchCandidates(paths, errors):
+    """Yields every regular file under the given paths (a path that is not a directory is yielded as is)."""
+    for top in paths:
+        if not os.path.isdir(top):
+            yield top
+            continue
+        for path, entry in scanEntries(top, recursive=True, errors=errors):
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    yield path if top == "." else os.path.join(top, path)
+            except OSError:
+                pass
+
+
+def searchFiles(pattern, paths=(".",), ignoreCase=False, fixed=False, listOnly=False,
+                workers=None, maxSize=SEARCH_MAX_MB * 1024 * 1024, errors=None):
+    """Yields the searchFile result of every candidate file as soon as it is searched (the data behind search).
+
+    Input: takes a pattern, the files/directories to search, the -i/-F/-l choices, the
+           number of worker processes (default: CPU count), the largest file size to search
+           and an optional list that collects OSErrors from the directory walk
+    Action: walks paths with searchCandidates; a small set of files (or one worker) is
+            searched in this process, anything larger by a multiprocessing Pool through
+            imap_unordered, which consumes the walk as the workers need more files
+    Output: yields (path, matches, error) per file, in completion order
+            (raises re.error for an invalid pattern)
+    """
+    import itertools, re
+    if isinstance(pattern, str):
+        pattern = pattern.encode("utf-8", "surrogateescape")
+    if fixed:
+        pattern = re.escape(pattern)
+    flags = re.MULTILINE | (re.IGNORECASE if ignoreCase else 0)     # ^ and $ match at every line
+    re.compile(pattern, flags)      # report a bad pattern here rather than in every worker
+    searchInit(pattern, flags, listOnly, maxSize)
+
+    candidates = searchCandidates(paths, errors)
+    workers = workers or cpuCount()
+    first = list(itertools.islice(candidates, SEARCH_INLINE))
+    if workers <= 1 or len(first) < SEARCH_INLINE:
+        yield from map(searchFile, itertools.chain(first, candidates))
+        return
+    import multiprocessing
+    with multiprocessing.Pool(workers, searchInit, (pattern, flags, listOnly, maxSize)) as pool:
+        yield from pool.imap_unordered(searchFile, itertools.chain(first, candidates), chunksize=8)
+
+
+def renderSearch(results, listOnly=False):
+    """Returns exit status (0 matched, 1 no match, 2 error) after printing searchFiles results as they arrive."""
+    status = 1
+    write = sys.stdout.write
+    for path, matches, error in results:
+        if error is not None:
+            print(Fore.RED + "ERROR - " + path + ": " + error + Fore.WHITE)
+            status = 2
+            continue
+        if not matches:
+            continue
+        if status == 1:
+            status = 0
+        if listOnly:
+            write(Fore.BLUE + path + Fore.WHITE + "\n")
+            continue
+        for lineno, line in matches:
+            write(Fore.BLUE + path + Fore.WHITE + ":" + str(lineno) + ":" + line.decode("utf-8", "replace") + "\n")
+        sys.stdout.flush()
+    return status
+
+
+def searchCmd(fields):
+    """Returns exit status after printing every line that matches a pattern in the files searched.
+
+    Input: takes a list of text fields
+    Action: searches the files under each path (see searchFiles) and prints
+            "path:line number:line" for each match, or just the file names with -l
+    Output: returns exit status (0 if something matched, 1 if nothing did, 2 on error)
+    """
+    try:
+        options, operands = splitOptions(fields, "iFl", "jm")
+        workers = int(options["-j"]) if "-j" in options else None
+        maxSize = int(float(options.get("-m", SEARCH_MAX_MB)) * 1024 * 1024)
+    except ValueError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        return 2
+    if not operands:
+        print("Missing argument for command", fields[0])
+        return 2
+
+    import re
+    errors = []
+    listOnly = "-l" in options
+    try:
+        results = searchFiles(operands[0], operands[1:] or ["."], "-i" in options, "-F" in options,
+                              listOnly, workers, maxSize, errors)
+        status = renderSearch(results, listOnly)
+    except re.error as error:
+        print(Fore.RED + "ERROR - Bad pattern: " + str(error) + Fore.WHITE)
+        return 2
+    for error in errors:
+        print(Fore.RED + "ERROR - " + str(error.filename) + ": " + error.strerror + Fore.WHITE)
+        status = 2
+    return status
+
+
+# ====================================================
+#  Watch command, re-runs a command whenever watched files change
+#       watch [-r] [-d MS] [-n N] [path ...] -- command [args]
+#           runs command once, then again after each burst of changes to the paths
+#           (default: the working directory); -r also watches every sub directory
+#           (including ones created later), -d waits for MS milliseconds without events
+#           before re-running (default 200), -n stops after N re-runs. Ctrl-C stops watching.
+#  The shell sleeps in select() on a Linux inotify descriptor (opened through ctypes)
+#  instead of re-scanning. A command that writes into a watched path triggers itself again.
+#=====================================================
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF, IN_IGNORED, IN_ISDIR = 0x400, 0x800, 0x8000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = os.O_NONBLOCK, os.O_CLOEXEC
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+WATCH_DEBOUNCE_MS = 200
+
+
+class Inotify:
+    """A Linux inotify descriptor, driven through libc's inotify_init1/inotify_add_watch via ctypes."""
+
+    def __init__(self):
+        import ctypes
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self.fail(None)
+        self.paths = {}     # watch descriptor -> watched path
+
+    def fail(self, path):
+        """Raises OSError for the errno left by the last libc call."""
+        code = self.ctypes.get_errno()
+        raise OSError(code, os.strerror(code), path)
+
+    def add(self, path):
+        """Starts watching path (raises OSError)."""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            self.fail(path)
+        self.paths[wd] = path
+
+    def read(self):
+        """Returns [(path, mask), ...] for every event queued so far (empty if there are none)."""
+        import struct
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+                offset += 16 + length
+                base = self.paths.get(wd)
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)    # the watched path is gone
+                    continue
+                if base is not None and name:
+                    base = os.path.join(base, os.fsdecode(name))
+                events.append((base, mask))
+
+    def close(self):
+        """Closes the descriptor, removing every watch."""
+        os.close(self.fd)
+
+
+def watchPaths(inotify, paths, recursive, errors):
+    """Adds a watch for every path (and, with recursive, every directory below it), collecting error messages."""
+    for path in paths:
+        try:
+            inotify.add(path)
+        except OSError as error:
+            errors.append(path + ": " + error.strerror)
+            continue
+        if recursive and os.path.isdir(path):
+            for relative, entry in scanEntries(path, recursive=True):
+                if entry.is_dir(follow_symlinks=False):
+                    try:
+                        inotify.add(os.path.join(path, relative))
+                    except OSError as error:
+                        errors.append(os.path.join(path, relative) + ": " + error.strerror)
+
+
+def watchCmd(fields):
+    """Returns exit status after re-running a command each time the watched paths change.
+
+    Input: takes a list of text fields: options and paths, "--", then the command
+    Action: runs the command through COMMANDS.dispatch, then blocks in select() on an
+            inotify descriptor; after the first event it keeps collecting events until none
+            arrive for the debounce interval, then re-runs the command
+    Output: returns exit status of the last run of the command (1 on a usage error)
+    """
+    import select
+    if "--" not in fields or fields.index("--") == len(fields) - 1:
+        print("Usage: watch [-r] [-d MS] [-n N] [path ...] -- command [args]")
+        return 1
+    split = fields.index("--")
+    command = fields[split + 1:]
+    try:
+        options, paths = splitOptions(fields[:split], "r", "dn")
+        debounce = int(options.get("-d", WATCH_DEBOUNCE_MS)) / 1000
+        limit = int(options["-n"]) if "-n" in options else None
+    except ValueError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        return 1
+
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError):
+        print(Fore.RED + "ERROR - watch needs Linux inotify" + Fore.WHITE)
+        return 1
+    try:
+        errors = []
+        watchPaths(inotify, paths or ["."], "-r" in options, errors)
+        for error in errors:
+            print(Fore.RED + "ERROR - " + error + Fore.WHITE)
+        if not inotify.paths:
+            return 1
+
+        status = COMMANDS.dispatch(command)
+        runs = 0
+        while limit is None or runs < limit:
+            sys.stdout.flush()
+            select.select([inotify.fd], [], [])
+            changed = []
+            while True:
+                for path, mask in inotify.read():
+                    if path is not None and path not in changed:
+                        changed.append(path)
+                    if "-r" in options and mask & IN_CREATE and mask & IN_ISDIR and path is not None:
+                        watchPaths(inotify, [path], True, [])
+                if not select.select([inotify.fd], [], [], debounce)[0]:
+                    break
+            if not inotify.paths:
+                print(Fore.RED + "ERROR - Nothing left to watch" + Fore.WHITE)
+                break
+            shown = ", ".join(changed[:3]) + (" and " + str(len(changed) - 3) + " more" if len(changed) > 3 else "")
+            print(Fore.BLUE + "--- changed: " + shown + Fore.WHITE)
+            status = COMMANDS.dispatch(command)
+            runs += 1
+        return status
+    except KeyboardInterrupt:
+        print()
+        return 130
+    finally:
+        inotify.close()
+
+
+# ====================================================
+#  Working directory tracking
+#       The shell keeps its (logical) working directory in CWD and only changes
+#       directory through changeDirectory, so where/down/up never need os.getcwd()
+#       and relative moves are plain string joins.
+#=====================================================
+DIR_HISTORY_SIZE = 200      # recently visited directories remembered for jump
+
+
+def initialDirectory():
+    """Returns the starting working directory: $PWD when it names the real one (keeps symlinked paths), else os.getcwd()."""
+    cwd = os.environ.get("PWD")
+    try:
+        if cwd and os.path.isabs(cwd) and os.path.samestat(os.stat(cwd), os.stat(".")):
+            return os.path.normpath(cwd)
+    except OSError:
+        pass
+    return os.getcwd()
+
+
+CWD = initialDirectory()
+OLDPWD = None
+DIR_STACK = []
+DIR_HISTORY = collections.OrderedDict()     # directory -> visit count, least recently used first
+
+
+def changeDirectory(path):
+    """Returns the new working directory after changing into path.
+
+    Input: takes an absolute or relative directory name
+    Action: resolves path against CWD without touching the file system (".." removes the
+            last component, as in "cd -L"), chdir's there, and updates CWD, OLDPWD, $PWD,
+            $OLDPWD and the bounded list of recently visited directories
+    Output: returns new CWD (raises OSError if the directory cannot be entered)
+    """
+    global CWD, OLDPWD
+    target = os.path.normpath(os.path.join(CWD, path))
+    if target.startswith("//"):
+        target = target[1:]
+    os.chdir(target)
+    OLDPWD, CWD = CWD, target
+    os.environ["OLDPWD"] = OLDPWD
+    os.environ["PWD"] = CWD
+    DIR_HISTORY[CWD] = DIR_HISTORY.pop(CWD, 0) + 1
+    if len(DIR_HISTORY) > DIR_HISTORY_SIZE:
+        DIR_HISTORY.popitem(last=False)
+    return CWD
+
+
+def moveTo(path):
+    """Returns exit status after changeDirectory(path), printing an error on failure."""
+    try:
+        changeDirectory(path)
+        return 0
+    except FileNotFoundError:
+        print(Fore.RED + "ERROR - Directory not found" + Fore.WHITE)
+    except OSError as error:
+        print(Fore.RED + "ERROR - " + path + ": " + error.strerror + Fore.WHITE)
+    return 1
+
+# ====================================================
+#  Where command,  prints name of current working directory
+#       
+#       0 Command arguments.
+#=====================================================
+
+def whereCmd(feilds):
+
+    """Return nothing after printing the name of the current working dir as a string to console
+    
+    Input: takes a list of text fields
+    Action: Prints current working dir to console
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+
+    if checkArgs(feilds, 0):
+        print(CWD)
+        return 0
+    return 1
+
+
+def downCmd(fields):
+
+    """Return nothing after mocing into target sub diretory
+    
+    Input: takes a list of text fields
+    Action: Move into target sub directory 
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if checkArgs(fields, 1):
+        return moveTo(fields[1])
+    return 1
+
+# ====================================================
+#  Up command, moves up the working dir tree
+#       0 commands
+#=====================================================
+
+def upCmd(fields):
+
+    """Return nothing after moving up the working tree
+    
+    Input: takes a list of text fields
+    Action: move up tree
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if checkArgs(fields, 0):
+        try:
+            if not CWD == "/":
+                changeDirectory("..")
+                return 0
+            else:
+                print(Fore.RED + "ERROR -AT HOME DIRECTORY, CANNOT STEP BACK" + Fore.WHITE)
+        except OSError:
+            print(Fore.RED + "ERROR - CANNOT STEP BACK" + Fore.WHITE)
+    return 1
+
+# ====================================================
+#  Cd command, changes the working directory
+#       0 Command arguments: home directory
+#       1 Command argument: directory, or "-" for the previous one
+#=====================================================
+
+def cdCmd(fields):
+
+    """Return nothing after changing into the target directory
+
+    Input: takes a list of text fields
+    Action: changes to the named directory, $HOME without one, or the previous
+            directory (printing it) for "-"
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if len(fields) > 2:
+        checkArgs(fields, 1)
+        return 1
+    target = fields[1] if len(fields) == 2 else os.path.expanduser("~")
+    if target == "-":
+        if OLDPWD is None:
+            print(Fore.RED + "ERROR - No previous directory" + Fore.WHITE)
+            return 1
+        target = OLDPWD
+        print(target)
+    return moveTo(target)
+
+# ====================================================
+#  Pushd / popd / dirs commands, a stack of directories
+#       pushd [dir]  remember the current directory and change to dir
+#                    (without dir: swap with the top of the stack)
+#       popd         change back to the directory on top of the stack
+#       dirs         print the current directory followed by the stack
+#=====================================================
+
+def pushdCmd(fields):
+
+    """Return nothing after pushing the current directory and changing directory
+
+    Input: takes a list of text fields
+    Action: pushes CWD onto DIR_STACK and changes into fields[1] (or the top of the stack)
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if len(fields) > 2:
+        checkArgs(fields, 1)
+        return 1
+    if len(fields) == 1:
+        if not DIR_STACK:
+            print(Fore.RED + "ERROR - Directory stack is empty" + Fore.WHITE)
+            return 1
+        target = DIR_STACK.pop()
+    else:
+        target = fields[1]
+    previous = CWD
+    if moveTo(target) != 0:
+        if len(fields) == 1:
+            DIR_STACK.append(target)
+        return 1
+    DIR_STACK.append(previous)
+    return dirsCmd(fields[:1])
+
+
+def popdCmd(fields):
+
+    """Return nothing after changing to the directory on top of the stack
+
+    Input: takes a list of text fields
+    Action: pops DIR_STACK and changes into that directory
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if not checkArgs(fields, 0):
+        return 1
+    if not DIR_STACK:
+        print(Fore.RED + "ERROR - Directory stack is empty" + Fore.WHITE)
+        return 1
+    if moveTo(DIR_STACK.pop()) != 0:
+        return 1
+    return dirsCmd(fields[:1])
+
+
+def dirsCmd(fields):
+
+    """Return nothing after printing the directory stack
+
+    Input: takes a list of text fields
+    Action: prints CWD followed by the stack, most recently pushed first
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if not checkArgs(fields, 0):
+        return 1
+    print(" ".join([CWD] + DIR_STACK[::-1]))
+    return 0
+
+# ====================================================
+#  Jump command, fuzzy change to a recently visited directory
+#       1+ Command arguments: fragments that must appear, in order, in the directory name
+#=====================================================
+
+def fuzzyScore(path, fragments):
+    """Returns how well path matches the fragments (higher is better), or None if it does not.
+
+    Every fragment must occur in path (case-insensitively) after the previous one; a match in
+    the last path component and fewer characters between fragments score higher.
+    """
+    lowered = path.lower()
+    position = 0
+    gaps = 0
+    for fragment in fragments:
+        found = lowered.find(fragment.lower(), position)
+        if found < 0:
+            return None
+        gaps += found - position
+        position = found + len(fragment)
+    score = -gaps / (len(path) + 1)
+    if fragments[-1].lower() in os.path.basename(lowered):
+        score += 1
+    return score
+
+
+def jumpCmd(fields):
+
+    """Return nothing after changing to the best matching recently visited directory
+
+    Input: takes a list of text fields
+    Action: scores every directory in DIR_HISTORY with fuzzyScore, breaking ties by visit
+            count and recency, and changes into the best one (printing it)
+    Output: returns exit status (0 on success, 1 if nothing matches)
+    """
+
+    if len(fields) < 2:
+        print("Missing argument for command", fields[0])
+        return 1
+    best = None
+    for rank, (path, visits) in enumerate(DIR_HISTORY.items()):
+        score = fuzzyScore(path, fields[1:])
+        if score is not None and path != CWD:
+            key = (score, visits, rank)
+            if best is None or key > best[0]:
+                best = (key, path)
+    if best is None:
+        print(Fore.RED + "ERROR - No recent directory matches " + " ".join(fields[1:]) + Fore.WHITE)
+        return 1
+    print(best[1])
+    return moveTo(best[1])
+
+
+# ====================================================
+#  Exit command, Quit the shell
+#       0 commands
+#=====================================================
+
+def exitCmd(fields):
+
+    """Return nothing after exiting the shell
+
+    Input: takes a list of text fields
+    Action: Exit the shell with the status of the previous command
+    Output: returns 1 if the arguments are wrong (does not return otherwise)
+    """
+
+    if checkArgs(fields, 0):
+        print(Fore.GREEN + "Goodbye.." + Fore.WHITE)
+        sys.exit(LAST_STATUS)
+    return 1
+
+
+# ====================================================
+#  Alias command, lists or defines command aliases
+#       0 Command arguments: list all aliases
+#       2+ Command arguments: alias name followed by the command it expands to
+#=====================================================
+
+def aliasCmd(fields):
+
+    """Return nothing after listing or registering aliases
+
+    Input: takes a list of text fields
+    Action: with no arguments prints every alias, otherwise registers fields[1] as an
+            alias for the command given by the remaining fields
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if len(fields) == 1:
+        for name, target in sorted(COMMANDS.aliases.items()):
+            print(name + " = " + " ".join(target))
+    elif len(fields) == 2:
+        print("Missing argument for command", fields[0])
+        return 1
+    else:
+        COMMANDS.alias(fields[1], fields[2:])
+    return 0
+
+# ====================================================
+#  Set command, shows or changes run-time settings
+#       0 Command arguments: list all settings
+#       2 Command arguments: setting name, new value
+#=====================================================
+
+def setCmd(fields):
+
+    """Return nothing after listing or changing a setting
+
+    Input: takes a list of text fields
+    Action: prints every setting, or changes SETTINGS[fields[1]] to fields[2]
+            provided it is one of the values in SETTING_CHOICES
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if len(fields) == 1:
+        for name in sorted(SETTINGS):
+            choices = SETTING_CHOICES[name]
+            print(name + " = " + str(SETTINGS[name]) + ("  (" + "|".join(choices) + ")" if choices else ""))
+        return 0
+    if not checkArgs(fields, 2):
+        return 1
+    name, value = fields[1], fields[2]
+    if name not in SETTINGS:
+        print(Fore.RED + "ERROR - Unknown setting: " + name + Fore.WHITE)
+        return 1
+    if SETTING_CHOICES[name] is not None and value not in SETTING_CHOICES[name]:
+        print(Fore.RED + "ERROR - " + name + " must be one of: " + ", ".join(SETTING_CHOICES[name]) + Fore.WHITE)
+        return 1
+    SETTINGS[name] = value
+    return 0
+
+# ====================================================
+#  Command history
+#       An append-only file of one command per line plus an index file of 8-byte entry
+#       offsets. Both are memory-mapped at startup, so nothing is parsed until searched,
+#       and searches run as mmap.rfind scans in C, newest entry first.
+#=====================================================
+HISTORY_PATH = os.environ.get("PSHELL_HISTORY", os.path.join(os.path.expanduser("~"), ".pshell_history"))
+HISTORY_MAX_BYTES = 64 * 1024 * 1024    # rotate to <file>.1 beyond this, keeping the newest half
+HISTORY_LOAD = 1000                     # entries handed to readline at startup
+
+
+class HistoryStore:
+    """Append-only, indexed command history backed by mmap.
+
+    Entry n starts at offset index[n] of the data file and ends with a newline. Entries
+    appended after the files were mapped are kept in self.recent until the next open.
+    """
+
+    def __init__(self, path, maxBytes=HISTORY_MAX_BYTES):
+        self.path = path
+        self.indexPath = path + ".idx"
+        self.maxBytes = maxBytes
+        self.fd = self.indexFd = None
+        self.open()
+
+    def open(self, rebuild=True):
+        """Opens (creating if needed) and maps the data and index files, rebuilding a stale index.
+
+        A last line without its newline (a torn write, or a hand-edited file) is completed
+        first, so that it becomes an entry of its own.
+        """
+        import array
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o600)
+        self.indexFd = os.open(self.indexPath, os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o600)
+        self.completeLastLine()
+        self.size = os.fstat(self.fd).st_size
+        self.data = self.mapFile(self.fd, self.size)
+        indexSize = os.fstat(self.indexFd).st_size
+        self.index = self.mapFile(self.indexFd, indexSize - indexSize % 8)
+        self.offsets = memoryview(self.index).cast('Q') if self.index else array.array('Q')
+        self.mappedSize = self.size
+        self.recent = []
+        if rebuild and not self.consistent():
+            self.rebuildIndex()
+
+    def completeLastLine(self):
+        """Appends a newline to the data file if its last line lacks one."""
+        import fcntl
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self.fd).st_size
+            if size and os.pread(self.fd, 1, size - 1) != b"\n":
+                os.write(self.fd, b"\n")
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def mapFile(fd, size):
+        """Returns a read-only mmap of the first size bytes of fd (None when size is 0)."""
+        import mmap
+        return mmap.mmap(fd, size, access=mmap.ACCESS_READ) if size else None
+
+    def close(self):
+        """Unmaps and closes both files."""
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        for mapped in (self.data, self.index):
+            if mapped is not None:
+                mapped.close()
+        for fd in (self.fd, self.indexFd):
+            if fd is not None:
+                os.close(fd)
+        self.fd = self.indexFd = None
+
+    def consistent(self):
+        """Returns whether the index describes exactly the entries of the data file."""
+        count = len(self.offsets)
+        if self.size == 0:
+            return count == 0
+        if count == 0 or self.offsets[0] != 0 or self.offsets[-1] >= self.size:
+            return False
+        return self.data.find(b"\n", self.offsets[-1]) == self.size - 1
+
+    def rebuildIndex(self):
+        """Rewrites the index by scanning the data file for newlines (after a crash or rotation)."""
+        import array
+        offsets = array.array('Q')
+        if self.data is not None:
+            start = 0
+            while start < self.size:
+                offsets.append(start)
+                end = self.data.find(b"\n", start)
+                if end < 0:
+                    break       # cannot happen: open completes a torn last line
+                start = end + 1
+        temporary = self.indexPath + ".tmp"
+        with open(temporary, "wb") as index:
+            offsets.tofile(index)
+        os.replace(temporary, self.indexPath)
+        self.close()
+        self.open(rebuild=False)
+
+    def __len__(self):
+        return len(self.offsets) + len(self.recent)
+
+    def entry(self, number):
+        """Returns the text of entry number (0 is the oldest)."""
+        count = len(self.offsets)
+        if number >= count:
+            return self.recent[number - count]
+        start = self.offsets[number]
+        end = self.offsets[number + 1] if number + 1 < count else self.mappedSize
+        return self.data[start:end - 1].decode(errors="replace")
+
+    def append(self, line):
+        """Adds line (newlines folded to spaces) to the end of the history."""
+        import fcntl
+        text = line.replace("\n", " ")
+        data = (text + "\n").encode()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            offset = os.fstat(self.fd).st_size
+            # index first: a crash in between leaves an index the next open detects and rebuilds
+            os.write(self.indexFd, offset.to_bytes(8, sys.byteorder))
+            os.write(self.fd, data)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.recent.append(text)
+        self.size = offset + len(data)
+        if self.size > self.maxBytes:
+            self.rotate()
+
+    def rotate(self):
+        """Moves the history file to <file>.1 and starts a new one holding the newest half."""
+        keep = os.pread(self.fd, self.maxBytes // 2, max(self.size - self.maxBytes // 2, 0))
+        keep = keep[keep.find(b"\n") + 1:] if self.size > self.maxBytes // 2 else keep
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as data:
+            data.write(keep)
+        os.replace(self.path, self.path + ".1")
+        os.replace(temporary, self.path)
+        self.close()
+        os.unlink(self.indexPath)
+        self.open()
+
+    def search(self, pattern, prefix=False):
+        """Yields (number, text) of entries containing pattern (or starting with it), newest first.
+
+        The mapped part is scanned with mmap.rfind; each hit is turned into an entry
+        number by bisecting the offset index, then the scan skips to before that entry.
+        """
+        import bisect
+        count = len(self.offsets)
+        for number in range(len(self), count, -1):
+            text = self.recent[number - count - 1]
+            if text.startswith(pattern) if prefix else pattern in text:
+                yield number - 1, text
+        if self.data is None or not pattern:
+            for number in range(count - 1, -1, -1) if not pattern else ():
+                yield number, self.entry(number)
+            return
+
+        needle = ("\n" + pattern if prefix else pattern).encode()
+        end = self.mappedSize
+        while True:
+            position = self.data.rfind(needle, 0, end)
+            if position < 0:
+                break
+            if prefix:
+                number = bisect.bisect_left(self.offsets, position + 1)
+                end = position
+            else:
+                number = bisect.bisect_right(self.offsets, position) - 1
+                end = self.offsets[number]
+            yield number, self.entry(number)
+        if prefix and self.data[:len(needle) - 1] == needle[1:]:
+            yield 0, self.entry(0)
+
+
+HISTORY = {"store": None}
+
+
+def getHistory():
+    """Returns the shell's HistoryStore, opening it on first use (None if disabled or unavailable)."""
+    if HISTORY["store"] is None and HISTORY_PATH != "off":
+        try:
+            HISTORY["store"] = HistoryStore(HISTORY_PATH)
+        except OSError as error:
+            print(Fore.RED + "ERROR - Cannot open history: " + error.strerror + Fore.WHITE)
+            globals()["HISTORY_PATH"] = "off"
+    return HISTORY["store"]
+
+
+def loadReadline(history):
+    """Returns the readline module (None if unavailable) after setting it up.
+
+    Loads the newest history entries and installs completeLine as the Tab completer.
+    """
+    try:
+        import readline
+    except ImportError:
+        return None
+    if history is not None:
+        for number in range(max(len(history) - HISTORY_LOAD, 0), len(history)):
+            readline.add_history(history.entry(number))
+    readline.set_completer(completeLine)
+    readline.set_completer_delims(" \t\n;|&<>")
+    if "libedit" in (readline.__doc__ or ""):
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+    return readline
+
+# ====================================================
+#  History command, lists or searches the command history
+#       history [N]           the last N commands (default 20)
+#       history -s TEXT [-n N] commands containing TEXT, newest first
+#       history -p TEXT [-n N] commands starting with TEXT, newest first
+#=====================================================
+
+def historyCmd(fields):
+
+    """Return nothing after printing history entries
+
+    Input: takes a list of text fields
+    Action: prints numbered history entries, either the most recent ones or the matches of a
+            substring (-s) or prefix (-p) search
+    Output: returns exit status (0 on success, 1 on error or when nothing matched)
+    """
+
+    try:
+        options, words = splitOptions(fields, "", "spn")
+        limit = int(options.get("-n", words[0] if words else 20))
+    except ValueError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        return 1
+    history = getHistory()
+    if history is None:
+        print(Fore.RED + "ERROR - History is disabled" + Fore.WHITE)
+        return 1
+
+    if "-s" in options or "-p" in options:
+        prefix = "-p" in options
+        matches = history.search(options["-p" if prefix else "-s"], prefix)
+    else:
+        matches = ((number, history.entry(number)) for number in range(len(history) - 1, -1, -1))
+    found = []
+    for match in matches:
+        if len(found) == limit:
+            break
+        found.append(match)
+    for number, text in reversed(found):
+        print(str(number + 1).rjust(7) + "  " + text)
+    return 0 if found else 1
+
+# ====================================================
+#  Tab completion
+#       The first word of a command completes to builtins, aliases and executables on the
+#       search path; other words complete to file names. Both come from sorted name
+#       indexes that are rebuilt per directory only when that directory's mtime changes,
+#       so a completion costs a few stats and a bisect.
+#=====================================================
+DIR_INDEX_SIZE = 64     # directories whose listings are kept for filename completion
+DIR_INDEX = collections.OrderedDict()   # absolute dir -> (mtime_ns, sorted names, set of sub directory names)
+COMMAND_INDEX = {"key": None, "names": []}
+COMPLETIONS = []
+
+
+def prefixMatches(names, prefix):
+    """Yields the names in sorted list names that start with prefix."""
+    import bisect
+    for i in range(bisect.bisect_left(names, prefix), len(names)):
+        if not names[i].startswith(prefix):
+            break
+        yield names[i]
+
+
+def directoryIndex(path):
+    """Returns (sorted names, set of directory names) for directory path, rescanned only when its mtime changes."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return [], set()
+    cached = DIR_INDEX.get(path)
+    if cached is not None and cached[0] == mtime:
+        DIR_INDEX.move_to_end(path)
+        return cached[1], cached[2]
+    names = []
+    dirs = set()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                names.append(entry.name)
+                try:
+                    if entry.is_dir():
+                        dirs.add(entry.name)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    names.sort()
+    DIR_INDEX[path] = (mtime, names, dirs)
+    DIR_INDEX.move_to_end(path)
+    if len(DIR_INDEX) > DIR_INDEX_SIZE:
+        DIR_INDEX.popitem(last=False)
+    return names, dirs
+
+
+def commandNames():
+    """Returns the sorted list of builtin, alias and executable names.
+
+    Each search directory's executables come from scanPathDir (refreshed by mtime); the merged
+    list is rebuilt only when one of those directories or the set of builtins changed.
+    """
+    indexes = [scanPathDir(dir) for dir in THE_PATH if os.path.isabs(dir)]
+    key = (tuple(id(index) for index in indexes), len(COMMANDS.handlers), len(COMMANDS.aliases))
+    if COMMAND_INDEX["key"] != key:
+        names = set(COMMANDS.handlers) | set(COMMANDS.aliases)
+        for index in indexes:
+            names.update(index)
+        COMMAND_INDEX["key"], COMMAND_INDEX["names"] = key, sorted(names)
+    return COMMAND_INDEX["names"]
+
+
+def completeFilename(text):
+    """Returns the file names completing text (directories get a trailing '/')."""
+    if "/" in text:
+        head, tail = text.rsplit("/", 1)
+        head += "/"
+    else:
+        head, tail = "", text
+    directory = os.path.join(CWD, os.path.expanduser(head) if head else ".")
+    names, dirs = directoryIndex(os.path.normpath(directory))
+    return [head + name + ("/" if name in dirs else "")
+            for name in prefixMatches(names, tail)
+            if tail.startswith(".") or not name.startswith(".")]
+
+
+def completionCandidates(line, begidx, text):
+    """Returns the completions of text, the word starting at line[begidx].
+
+    A word in command position (start of line or after |, ;, &, && or ||) without a '/'
+    completes to command names, any other word to file names.
+    """
+    before = line[:begidx].rstrip()
+    if (not before or before[-1] in "|;&") and "/" not in text:
+        return list(prefixMatches(commandNames(), text))
+    return completeFilename(text)
+
+
+def completeLine(text, state):
+    """Returns the state-th completion of text (the readline completer)."""
+    if state == 0:
+        import readline
+        try:
+            COMPLETIONS[:] = completionCandidates(readline.get_line_buffer(), readline.get_begidx(), text)
+        except Exception:
+            COMPLETIONS[:] = []     # an exception here would be silently swallowed by readline anyway
+    return COMPLETIONS[state] if state < len(COMPLETIONS) else None
+
+# ====================================================
+#  Stats command, shows the timings collected for every command
+#       0 Command arguments: all commands
+#       1 Command argument: a command name, or "reset" to clear the statistics
+#=====================================================
+
+def statsCmd(fields):
+
+    """Return nothing after printing per-command statistics
+
+    Input: takes a list of text fields
+    Action: prints count, total and mean wall time, children's CPU time and max RSS and a
+            histogram of wall times for each command (slowest total first)
+    Output: returns exit status (0 on success, 1 on error)
+    """
+
+    if len(fields) > 2:
+        checkArgs(fields, 1)
+        return 1
+    if fields[1:] == ["reset"]:
+        COMMANDS.stats.clear()
+        return 0
+    names = fields[1:] or sorted(COMMANDS.stats, key=lambda name: -COMMANDS.stats[name].wall)
+    if names and names[0] not in COMMANDS.stats:
+        print(Fore.RED + "ERROR - No statistics for " + names[0] + Fore.WHITE)
+        return 1
+    print("command".ljust(16) + "count".rjust(8) + "total(s)".rjust(11) + "mean(ms)".rjust(11)
+          + "user(s)".rjust(10) + "sys(s)".rjust(10) + "maxrss(KB)".rjust(12))
+    for name in names:
+        stats = COMMANDS.stats[name]
+        print(name[:15].ljust(16) + str(stats.count).rjust(8) + ("%.3f" % stats.wall).rjust(11)
+              + ("%.3f" % (1000 * stats.wall / stats.count)).rjust(11) + ("%.3f" % stats.user).rjust(10)
+              + ("%.3f" % stats.sys).rjust(10) + str(stats.maxrss).rjust(12))
+        widest = max(stats.histogram)
+        for (_, label), count in zip(CommandStats.BUCKETS, stats.histogram):
+            if count:
+                print("    " + label.ljust(8) + ("#" * max(1, 40 * count // widest)).ljust(41) + str(count))
+    return 0
+
+
+# ====================================================
+#  FAST PATHS: in-process versions of common utilities
+#       With "set fastpath on" (or --fast-builtins, or PSHELL_FASTPATH=on) a plain command
+#       line running ls, cat, echo, true, false, pwd, mkdir or touch is handled without
+#       add_path, fork or exec. Each handler covers the everyday options only and returns
+#       NOT_HANDLED for anything else, before doing any work, so that the caller starts the
+#       real program the way it would have without fast paths. Pipelines still start the
+#       real programs.
+#=====================================================
+NOT_HANDLED = object()      # returned by a fast path that leaves the command to the real program
+COLLATE_C = ("", "C", "POSIX", "C.UTF-8", "C.utf8")     # locales where ls sorts by code point
+
+
+def collationIsC():
+    """Returns True if ls would sort names by code point (LC_ALL, LC_COLLATE or LANG is C/POSIX)."""
+    for name in ("LC_ALL", "LC_COLLATE", "LANG"):
+        value = os.environ.get(name)
+        if value:
+            return value in COLLATE_C
+    return True
+
+
+def fastError(fields, message):
+    """Prints "<command>: <message>" to stderr, as the real utilities do."""
+    sys.stdout.flush()
+    sys.stderr.write(fields[0] + ": " + message + "\n")
+
+
+def fastTrue(fields):
+    """Returns 0 (true)."""
+    return 0
+
+
+def fastFalse(fields):
+    """Returns 1 (false)."""
+    return 1
+
+
+def fastEcho(fields):
+    """Returns 0 after printing the arguments (-n: without the newline); any other option goes to the real echo."""
+
+    def isOption(arg):
+        return len(arg) > 1 and arg[0] == "-" and not arg[1:].strip("neE")
+
+    args = fields[1:]
+    newline = "\n"
+    if args and args[0] == "-n":
+        args, newline = args[1:], ""
+    if args and isOption(args[0]):
+        return NOT_HANDLED
+    sys.stdout.write(" ".join(args) + newline)
+    return 0
+
+
+def fastPwd(fields):
+    """Returns 0 after printing the working directory (-P, the default of the pwd program: symlinks resolved; -L: logical)."""
+    if len(fields) > 2 or (len(fields) == 2 and fields[1] not in ("-L", "-P")):
+        return NOT_HANDLED
+    print(CWD if fields[1:] == ["-L"] else os.path.realpath(CWD))
+    return 0
+
+
+def fastCat(fields):
+    """Returns exit status after copying each named file to stdout; no files, "-" or options go to the real cat."""
+    names = fields[1:]
+    if not names or any(name.startswith("-") for name in names):
+        return NOT_HANDLED
+    sys.stdout.flush()
+    output = getattr(sys.stdout, "buffer", None)
+    status = 0
+    for name in names:
+        try:
+            with open(name, "rb") as file:
+                while True:
+                    data = file.read(BUFFER_SIZE)
+                    if not data:
+                        break
+                    if output is not None:
+                        output.write(data)
+                    else:
+                        sys.stdout.write(data.decode("utf-8", "replace"))
+        except OSError as error:
+            fastError(fields, name + ": " + error.strerror)
+            status = 1
+    if output is not None:
+        output.flush()
+    return status
+
+
+def fastLs(fields):
+    """Returns exit status after listing names one per line, as ls does when writing to a pipe or file.
+
+    Supports -1, -a and -A with any number of files and directories; other options, a
+    terminal as stdout (where ls prints columns) and a non-C collation locale (where ls
+    sorts with strcoll) go to the real ls.
+    """
+    try:
+        options, names = splitOptions(fields, "1aA")
+    except ValueError:
+        return NOT_HANDLED
+    if sys.stdout.isatty() or not collationIsC():
+        return NOT_HANDLED
+
+    def visible(name):
+        return "-a" in options or "-A" in options or not name.startswith(".")
+
+    status = 0
+    files, dirs = [], []
+    for name in names or ["."]:
+        try:
+            info = os.stat(name)
+        except OSError as error:
+            if os.path.islink(name):
+                files.append(name)      # a dangling link is listed by name
+            else:
+                fastError(fields, "cannot access '" + name + "': " + error.strerror)
+                status = 2
+            continue
+        if stat.S_ISDIR(info.st_mode):
+            dirs.append(name)
+        else:
+            files.append(name)
+    lines = sorted(files)
+    for name in sorted(dirs):
+        try:
+            entries = sorted(entry for entry in os.listdir(name) if visible(entry))
+        except OSError as error:
+            fastError(fields, "cannot open directory '" + name + "': " + error.strerror)
+            status = 2
+            continue
+        if "-a" in options:
+            entries = [".", ".."] + entries
+        if len(files) + len(dirs) > 1:
+            if lines:
+                lines.append("")
+            lines.append(name + ":")
+        lines.extend(entries)
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+    return status
+
+
+def fastMkdir(fields):
+    """Returns exit status after creating each directory (-p: with parents, existing ones are fine)."""
+    try:
+        options, names = splitOptions(fields, "p")
+    except ValueError:
+        return NOT_HANDLED
+    if not names:
+        return NOT_HANDLED
+    status = 0
+    for name in names:
+        try:
+            if "-p" in options:
+                os.makedirs(name, exist_ok=True)
+            else:
+                os.mkdir(name)
+        except OSError as error:
+            fastError(fields, "cannot create directory '" + name + "': " + error.strerror)
+            status = 1
+    return status
+
+
+def fastTouch(fields):
+    """Returns exit status after setting each file's times to now, creating missing files; options go to the real touch."""
+    names = fields[1:]
+    if not names or any(name.startswith("-") for name in names):
+        return NOT_HANDLED
+    status = 0
+    for name in names:
+        try:
+            try:
+                os.utime(name)
+            except FileNotFoundError:
+                os.close(os.open(name, os.O_WRONLY | os.O_CREAT | os.O_NONBLOCK | os.O_NOCTTY, 0o666))
+        except OSError as error:
+            fastError(fields, "cannot touch '" + name + "': " + error.strerror)
+            status = 1
+    return status
+
+
+# ----------------------
+# Command registry
+# ----------------------
+class CommandRegistry:
+    """Maps command names to handler functions.
+
+    Every handler takes the list of text fields of one command line. Names that are
+    neither registered nor aliased are passed to the fallback handler (runCmd).
+    A CommandStats (invocations, wall time, children's CPU time and RSS) is kept per
+    command name, and every run is written to the trace file when one is set.
+    """
+
+    def __init__(self, fallback):
+        self.handlers = {}
+        self.aliases = {}
+        self.fastpaths = {}
+        self.fallback = fallback
+        self.stats = {}
+
+    def register(self, name, handler):
+        """Registers handler under name, replacing any earlier builtin of that name."""
+        self.handlers[name] = handler
+
+    def fastpath(self, name, handler):
+        """Registers an in-process stand-in for program name, used only while SETTINGS["fastpath"] is "on".
+
+        The handler returns NOT_HANDLED for command lines it does not support; the
+        caller then runs the real program through its usual external path.
+        """
+        self.fastpaths[name] = handler
+
+    def alias(self, name, target):
+        """Makes name expand to the list of fields in target (expanded once, not recursively)."""
+        self.aliases[name] = list(target)
+
+    def lookup(self, name, fast=True):
+        """Returns the handler that would run for command name (fast: fast paths may be used)."""
+        handler = self.handlers.get(name)
+        if handler is None:
+            if fast and SETTINGS["fastpath"] == "on":
+                return self.fastpaths.get(name, self.fallback)
+            return self.fallback
+        return handler
+
+    def resolve(self, fields, fast=True):
+        """Returns (fields, handler) after alias expansion of the command in fields."""
+        target = self.aliases.get(fields[0])
+        if target is not None:
+            fields = target + fields[1:]
+        return fields, self.lookup(fields[0], fast)
+
+    def dispatch(self, fields):
+        """Returns the exit status of the command in fields.
+
+        Input: takes a list of text fields
+        Action: expands an alias, runs the matching handler and records its count and time
+        Output: returns the handler's exit status (a handler returning None counts as 0)
+        """
+        fields, handler = self.resolve(fields)
+        status = 1
+        usage = beginUsage()
+        try:
+            status = handler(fields)
+            if status is NOT_HANDLED:
+                status = self.fallback(fields)
+            status = 0 if status is None else status
+            return status
+        finally:
+            self.record(fields[0], fields, status, endUsage(usage))
+
+    def record(self, name, fields, status, usage):
+        """Adds one run of command name to its stats and to the trace file.
+
+        Input: takes the command name, its fields, exit status and the
+               (wall, user, sys, maxrss) tuple from endUsage
+        """
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = CommandStats()
+        stats.add(*usage)
+        writeTrace(name, fields, status, usage)
+
+
+class CommandStats:
+    """Aggregated timings of one command: totals plus a histogram of wall times."""
+
+    # upper bounds (seconds) and labels of the histogram buckets
+    BUCKETS = ((1e-4, "<100us"), (1e-3, "<1ms"), (1e-2, "<10ms"), (1e-1, "<100ms"),
+               (1.0, "<1s"), (10.0, "<10s"), (float("inf"), ">=10s"))
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.user = 0.0
+        self.sys = 0.0
+        self.maxrss = 0
+        self.histogram = [0] * len(self.BUCKETS)
+
+    def add(self, wall, user, system, maxrss):
+        """Records one run."""
+        self.count += 1
+        self.wall += wall
+        self.user += user
+        self.sys += system
+        self.maxrss = max(self.maxrss, maxrss)
+        for i, (bound, _) in enumerate(self.BUCKETS):
+            if wall < bound:
+                self.histogram[i] += 1
+                break
+
+
+def beginUsage():
+    """Returns the starting point for endUsage, and restarts CHILD_USAGE's maxrss tracking."""
+    start = (time.perf_counter(), CHILD_USAGE["user"], CHILD_USAGE["sys"], CHILD_USAGE["maxrss"])
+    CHILD_USAGE["maxrss"] = 0
+    return start
+
+
+def endUsage(start):
+    """Returns (wall seconds, children's user seconds, sys seconds, max RSS in KB) since beginUsage."""
+    wall, user, system, maxrss = start
+    rss = CHILD_USAGE["maxrss"]
+    CHILD_USAGE["maxrss"] = max(maxrss, rss)
+    return time.perf_counter() - wall, CHILD_USAGE["user"] - user, CHILD_USAGE["sys"] - system, rss
+
+
+TRACE = {"path": None, "file": None}
+
+
+def writeTrace(name, fields, status, usage):
+    """Appends one JSON line describing a command run to the file in SETTINGS["trace"] (if not "off")."""
+    path = SETTINGS["trace"]
+    if path == "off":
+        return
+    import json
+    if TRACE["path"] != path:
+        if TRACE["file"] is not None:
+            TRACE["file"].close()
+        TRACE["path"], TRACE["file"] = path, None
+        try:
+            TRACE["file"] = open(path, "a", buffering=1)
+        except OSError as error:
+            print(Fore.RED + "ERROR - Cannot open trace file: " + error.strerror + Fore.WHITE)
+    if TRACE["file"] is not None:
+        wall, user, system, maxrss = usage
+        TRACE["file"].write(json.dumps({"time": time.time(), "command": name, "args": fields[1:],
+                                        "status": status, "wall": wall, "user": user, "sys": system,
+                                        "maxrss_kb": maxrss}) + "\n")
+
+
+# ----------------------
+# Other functions
+# ----------------------
+def splitOptions(fields, flags="", valued=""):
+    """Returns (options, operands) for the arguments in fields[1:].
+
+    Input: takes a list of text fields, the letters of options without a value and the
+           letters of options that take one (as "-j 4" or "-j4")
+    Action: separates leading-dash options (letters may be combined, e.g. "-rv") from the
+            other arguments; "--" ends the options
+    Output: returns dictionary of "-x" -> True or value, and list of remaining fields
+            (raises ValueError for an unknown option or a missing value)
+    """
+    options = {}
+    operands = []
+    args = iter(fields[1:])
+    for field in args:
+        if field == "--":
+            operands.extend(args)
+            break
+        if not field.startswith('-') or len(field) == 1:
+            operands.append(field)
+            continue
+        for i, letter in enumerate(field[1:], 1):
+            if letter in valued:
+                value = field[i + 1:] or next(args, None)
+                if value is None:
+                    raise ValueError("Missing value for option -" + letter + " of command " + fields[0])
+                options["-" + letter] = value
+                break
+            if letter not in flags:
+                raise ValueError("Unknown option -" + letter + " for command " + fields[0])
+            options["-" + letter] = True
+    return options, operands
+
+def checkArgs(fields, num):
+    """Returns if len(fields)-1 == num (prints error to shell if not).
+    
+    Input: takes a list of text fields and how many non-command fields are expected
+    Action: prints an error message if the number of fields is unexpected
+    Output: returns boolean value to indicate if it was expected number of fields
+    """
+    
+    numArgs = len(fields) - 1
+    if numArgs == num:
+        return True
+    if numArgs > num:
+        print("Unexpected argument", fields[num+1], "for command", fields[0])
+    else:
+        print("Missing argument for command", fields[0])
+    
+    return False
+
+# ====================================================
+#  Asyncio core
+#       AsyncSession runs command lines on an asyncio event loop. External programs are
+#       resolved with add_path and started with asyncio.create_subprocess_exec; the stdout
+#       and stderr of every stage are read concurrently as they arrive. Builtins run
+#       in-process with their output captured. Each session keeps its own working
+#       directory and $?, so one process can drive many sessions at once.
+#       Builtins run synchronously, and "&" pipelines become tasks of the session rather
+#       than entries in the job table.
+# ====================================================
+RunResult = collections.namedtuple("RunResult", "status stdout stderr")
+DEVNULL = -3    # subprocess.DEVNULL, without importing subprocess at startup
+
+
+class OutputSink:
+    """Collects the stdout/stderr bytes of a run, or hands each chunk to a callback."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.chunks = {"stdout": [], "stderr": []}
+
+    def write(self, name, data):
+        """Takes one chunk of output; name is "stdout" or "stderr"."""
+        if not data:
+            return
+        if self.callback is not None:
+            self.callback(name, data)
+        else:
+            self.chunks[name].append(data)
+
+    def result(self, status):
+        """Returns a RunResult with status and everything collected."""
+        return RunResult(status, b"".join(self.chunks["stdout"]), b"".join(self.chunks["stderr"]))
+
+
+class AsyncSession:
+    """One shell session driven from asyncio.
+
+    await session.run(line) runs a command line and returns a RunResult of the last
+    command's exit status and the bytes written to stdout and stderr. When output is
+    given, it is called as output(name, data) for each chunk as it arrives instead (the
+    RunResult then holds empty bytes). stdin is what external programs read (default:
+    /dev/null; None shares the shell's own stdin).
+    """
+
+    def __init__(self, cwd=None, output=None, stdin=DEVNULL):
+        self.cwd = cwd or CWD
+        self.oldpwd = None
+        self.status = 0
+        self.output = output
+        self.stdin = stdin
+        self.closed = False         # set by the exit builtin
+        self.foreground = []        # processes of the pipeline being awaited
+        self.background = {}        # task -> command text, for every "&" chain
+
+    async def run(self, line):
+        """Returns a RunResult after running one command line in this session."""
+        import asyncio
+        sink = OutputSink(self.output)
+        try:
+            ast = parseLine(line)
+        except ParseError as error:
+            sink.write("stderr", ("ERROR - " + str(error) + "\n").encode())
+            self.status = 2
+            return sink.result(self.status)
+        for andOr, background in ast.items:
+            if background:
+                task = asyncio.ensure_future(self.runBackground(andOr, self.status))
+                self.background[task] = andOr.text
+                task.add_done_callback(self.finished)
+            else:
+                self.status = await self.runAndOr(andOr, sink, self.status)
+        return sink.result(self.status)
+
+    async def runBackground(self, node, status):
+        """Returns the RunResult of an "&" chain, run concurrently with the session.
+
+        status is the $? the chain starts with; its own result never becomes the session's $?.
+        """
+        sink = OutputSink(self.output)
+        return sink.result(await self.runAndOr(node, sink, status))
+
+    def finished(self, task):
+        """Reports a finished "&" chain through the output callback (when there is one)."""
+        text = self.background.pop(task)
+        if self.output is not None and not task.cancelled():
+            status = task.result().status if task.exception() is None else 1
+            self.output("stderr", ("[done] " + str(status) + "  " + text + "\n").encode())
+
+    async def wait(self):
+        """Returns the RunResults of every "&" chain still running, once all have finished."""
+        import asyncio
+        return await asyncio.gather(*self.background)
+
+    def interrupt(self, signum=signal.SIGINT):
+        """Sends signum to the processes of the foreground pipeline."""
+        for process in self.foreground:
+            if process.returncode is None:
+                process.send_signal(signum)
+
+    async def runAndOr(self, node, sink, status):
+        """Returns the exit status of an AndOr node, with the same && / || rules as runAndOr.
+
+        status is the $? seen by the first pipeline; each later one sees its predecessor's.
+        """
+        status = await self.runPipeline(node.first, sink, status)
+        for operator, pipeline in node.rest:
+            if (status == 0) == (operator == "&&"):
+                status = await self.runPipeline(pipeline, sink, status)
+        return status
+
+    async def runPipeline(self, node, sink, lastStatus):
+        """Returns the exit status of the last stage of a Pipeline node.
+
+        Input: takes a Pipeline node, the OutputSink of the run and the $? to expand words with
+        Action: starts every external stage with asyncio.create_subprocess_exec, connecting
+                neighbours with kernel pipes; a builtin stage runs in-process and its output
+                becomes the next stage's stdin. The last stage's stdout and every stage's
+                stderr are read concurrently into sink.
+        Output: returns exit status of the last stage (1 if a redirection cannot be opened)
+        """
+        import asyncio
+        global LAST_STATUS
+        start = time.perf_counter()
+        LAST_STATUS = lastStatus
+        stages = [expandCommand(command) for command in node.commands]
+        if any(not fields for fields, _ in stages):
+            if len(stages) == 1 and not stages[0][1]:
+                return 0
+            sink.write("stderr", ("ERROR - empty command in: " + node.text + "\n").encode())
+            return 2
+
+        # as in the sync core, fast paths only stand in for a lone command
+        resolved = [COMMANDS.resolve(fields, fast=len(stages) == 1) for fields, _ in stages]
+        builtin = [handler is not COMMANDS.fallback for _, handler in resolved]
+        processes, readers, opened = [], [], []
+        status, lastProcess = 0, None
+        try:
+            prevRead, feed = None, None
+            try:
+                for i, ((fields, handler), (_, redirects)) in enumerate(zip(resolved, stages)):
+                    last = i == len(stages) - 1
+                    files = {}
+                    try:
+                        for operator, filename in redirects:
+                            target, fd = openRedirect(operator, os.path.join(self.cwd, filename))
+                            opened.append(fd)
+                            files[target] = fd
+                    except OSError as error:
+                        sink.write("stderr", ("ERROR - " + error.filename + ": " + error.strerror + "\n").encode())
+                        status, lastProcess = 1, None
+                        break
+
+                    if builtin[i]:
+                        status, out, err = self.runBuiltin(handler, fields)
+                    if builtin[i] and status is NOT_HANDLED:
+                        builtin[i] = False      # a fast path declined: start the real program
+                    elif builtin[i]:
+                        sink.write("stderr", err)
+                        if 1 in files:
+                            os.write(files[1], out)
+                        elif last:
+                            sink.write("stdout", out)
+                        else:
+                            feed = out
+                        prevRead, lastProcess = None, None
+                        continue
+
+                    stdin = files.get(0, prevRead if prevRead is not None else self.stdin)
+                    if feed is not None and 0 not in files:
+                        stdin = asyncio.subprocess.PIPE
+                    nextRead = None
+                    if 1 in files:
+                        stdout = files[1]
+                    elif last:
+                        stdout = asyncio.subprocess.PIPE
+                    elif builtin[i + 1]:
+                        stdout = asyncio.subprocess.DEVNULL     # builtins do not read stdin
+                    else:
+                        nextRead, stdout = os.pipe()
+                        opened += [nextRead, stdout]
+                    prevRead, lastProcess = nextRead, None
+
+                    execname = add_path(fields[0], THE_PATH)
+                    try:
+                        if execname is None:
+                            raise FileNotFoundError(0, "not found")
+                        process = await asyncio.create_subprocess_exec(
+                            fields[0], *fields[1:], executable=execname, cwd=self.cwd,
+                            stdin=stdin, stdout=stdout, stderr=asyncio.subprocess.PIPE)
+                    except OSError as error:
+                        sink.write("stderr", ("Executable file " + fields[0] + " " + error.strerror + "\n").encode())
+                        status, feed = 127, None
+                        continue
+
+                    processes.append(process)
+                    lastProcess = process
+                    if stdin == asyncio.subprocess.PIPE:
+                        readers.append(feedInput(process.stdin, feed))
+                    feed = None
+                    readers.append(pumpOutput(process.stderr, "stderr", sink))
+                    if stdout == asyncio.subprocess.PIPE:
+                        readers.append(pumpOutput(process.stdout, "stdout", sink))
+            finally:
+                # the children hold their own copies; ours would keep the pipes open
+                for fd in opened:
+                    os.close(fd)
+
+            self.foreground = processes
+            await asyncio.gather(*readers)
+            for process in processes:
+                await process.wait()
+        except asyncio.CancelledError:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+            raise
+        finally:
+            self.foreground = []
+
+        if lastProcess is not None:
+            status = lastProcess.returncode
+        # asyncio reaps the children itself, so only the wall time is known here
+        wall = time.perf_counter() - start
+        COMMANDS.record(" | ".join(fields[0] for fields, _ in resolved), resolved[0][0], status,
+                        (wall, 0.0, 0.0, 0))
+        if node.timed:
+            sink.write("stderr", ("real %.3fs\n" % wall).encode())
+        return status
+
+    def runBuiltin(self, handler, fields):
+        """Returns (status, stdout bytes, stderr bytes) of a builtin run in this session's directory.
+
+        The shell's CWD, OLDPWD, $PWD, $OLDPWD and process directory are put back afterwards,
+        so a cd in one session does not move the host or any other session.
+        """
+        global CWD, OLDPWD
+        saved = CWD, OLDPWD, os.environ.get("PWD"), os.environ.get("OLDPWD")
+        if CWD != self.cwd:
+            try:
+                os.chdir(self.cwd)
+            except OSError:
+                pass
+            CWD, OLDPWD = self.cwd, self.oldpwd
+        out, err = io.StringIO(), io.StringIO()
+        status = 1
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                status = handler(fields)
+                status = 0 if status is None else status
+            except SystemExit as exit:
+                status = exit.code if isinstance(exit.code, int) else 0
+                self.closed = True
+            except Exception as error:
+                print(Fore.RED + "ERROR - " + fields[0] + ": " + str(error) + Fore.WHITE, file=sys.stderr)
+        self.cwd, self.oldpwd = CWD, OLDPWD
+        if CWD != saved[0]:
+            try:
+                os.chdir(saved[0])
+            except OSError:
+                pass
+        CWD, OLDPWD = saved[:2]
+        for name, value in (("PWD", saved[2]), ("OLDPWD", saved[3])):
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        return status, out.getvalue().encode(), err.getvalue().encode()
+
+
+async def pumpOutput(stream, name, sink):
+    """Copies everything read from an asyncio stream into sink under name."""
+    while True:
+        data = await stream.read(BUFFER_SIZE)
+        if not data:
+            return
+        sink.write(name, data)
+
+
+async def feedInput(stream, data):
+    """Writes data to a child's stdin and closes it (a child that exits early is not an error)."""
+    try:
+        stream.write(data)
+        await stream.drain()
+        stream.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+def writeOutput(name, data):
+    """Output callback of the interactive session: writes a chunk straight to stdout or stderr."""
+    stream = sys.stdout if name == "stdout" else sys.stderr
+    sys.stdout.flush()
+    stream.buffer.write(data)
+    stream.flush()
+
+
+async def runAsyncBatch(stream, report=False):
+    """Returns the exit status of the last command after running every line of stream in an AsyncSession."""
+    session = AsyncSession(output=writeOutput, stdin=None)
+    for lineno, line in readCommands(stream):
+        result = await session.run(line)
+        if report and line.strip() and not line.lstrip().startswith("#"):
+            sys.stderr.write(str(lineno) + "\t" + str(result.status) + "\t" + line + "\n")
+        if session.closed:
+            break
+    await session.wait()
+    return session.status
+
+
+async def runAsyncInteractive():
+    """Returns the exit status of the last command after an interactive AsyncSession.
+
+    Input: no function arguments
+    Action: reads each line in a worker thread (readline keeps working) so the event loop
+            stays free to stream the output of "&" chains and report them as they finish;
+            Ctrl-C is forwarded to the foreground pipeline
+    Output: returns exit status of the last command run
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    history = getHistory()
+    loadReadline(history)
+    session = AsyncSession(output=writeOutput, stdin=None)
+    loop.add_signal_handler(signal.SIGINT, session.interrupt)
+    while not session.closed:
+        try:
+            line = await loop.run_in_executor(None, input, "PShell>")
+        except EOFError:
+            print()
+            break
+        if history is not None and line.strip():
+            history.append(line)
+        await session.run(line)
+    return session.status
+
+# ====================================================
+#  Programmatic API
+#       PShell gives Python code the shell's commands as methods that return data
+#       (the same functions the builtins render), so automation needs neither a child
+#       process nor text parsing. It works in the shell's own working directory (CWD).
+# ====================================================
+class PShell:
+    """In-process access to the shell's commands, returning structured results.
+
+    files, info, delete, copy, usage, sync and search return what listFiles, fileInfo,
+    deleteFiles, copyFiles, diskUsage, syncTree and searchFiles return; where/down/up
+    return the working directory; run returns the RunResult of any command line.
+    """
+
+    def files(self, top=".", recursive=False, sort=False, patterns=None, details=False):
+        """Returns {"entries": [records from listFiles], "errors": [messages]}."""
+        errors = []
+        entries = list(listFiles(top, recursive, sort, patterns, details, errors))
+        return {"entries": entries, "errors": [str(error.filename) + ": " + error.strerror for error in errors]}
+
+    def info(self, *names):
+        """Returns a list of stat records (see statRecord), {"name", "error"} for a missing file."""
+        return list(fileInfo(names))
+
+    def delete(self, *names, recursive=False, workers=1):
+        """Returns the result of deleteFiles for names."""
+        return deleteFiles(names, recursive, workers)
+
+    def copy(self, fromFile, toFile, recursive=False, preserve=False, workers=None):
+        """Returns the result of copyFiles."""
+        return copyFiles(fromFile, toFile, recursive, preserve, workers)
+
+    def usage(self, top=".", workers=None, fresh=False):
+        """Returns {"totals": {directory: bytes}, "counts", "errors"} from diskUsage (raises OSError)."""
+        errors = []
+        totals, counts = diskUsage(top, workers, fresh, errors)
+        USAGE_CACHE.save()
+        return {"totals": totals, "counts": counts, "errors": errors}
+
+    def sync(self, source, dest, workers=None, checksum=False, dryRun=False):
+        """Returns the result of syncTree."""
+        return syncTree(source, dest, workers, checksum, dryRun)
+
+    def search(self, pattern, *paths, ignoreCase=False, fixed=False, workers=None):
+        """Returns [(path, [(line number, line bytes)], error)] for every file that matched or failed."""
+        results = searchFiles(pattern, paths or (".",), ignoreCase, fixed, workers=workers)
+        return [result for result in results if result[1] or result[2]]
+
+    def where(self):
+        """Returns the working directory."""
+        return CWD
+
+    def down(self, name):
+        """Returns the new working directory after moving into sub directory name (raises OSError)."""
+        return changeDirectory(name)
+
+    def up(self):
+        """Returns the new working directory after moving to the parent directory (raises OSError at /)."""
+        if CWD == "/":
+            raise OSError(errno.ENOENT, "already at the root directory", CWD)
+        return changeDirectory("..")
+
+    def run(self, line):
+        """Returns the RunResult of a command line run with its output captured (see AsyncSession).
+
+        Not for use inside a running event loop: await AsyncSession.run there instead.
+        """
+        async def runAndWait():
+            session = AsyncSession()
+            result = await session.run(line)
+            await session.wait()
+            if session.cwd != CWD:
+                changeDirectory(session.cwd)
+            return result
+        import asyncio
+        return asyncio.run(runAndWait())
+
+# ---------------------------------------------------------------------
+
+def runLine(line):
+    """Returns the exit status of one command line.
+
+    Input: takes a line of text
+    Action: parses the line (see parseLine) and runs its commands: pipelines, redirections,
+            &&/|| chains, ";" sequences and "&" background jobs
+            (blank lines and lines starting with '#' are skipped)
+    Output: returns the exit status of the last command run (None for a skipped line)
+    """
+
+    global LAST_STATUS
+    try:
+        ast = parseLine(line)
+    except ParseError as error:
+        print(Fore.RED + "ERROR - " + str(error) + Fore.WHITE)
+        LAST_STATUS = 2
+        return LAST_STATUS
+    if not ast.items:
+        return None
+    for andOr, background in ast.items:
+        LAST_STATUS = runAndOr(andOr, background)
+    return LAST_STATUS
+
+
+def runAndOr(node, background=False):
+    """Returns the exit status of an AndOr node.
+
+    Input: takes an AndOr node and whether it ends in "&"
+    Action: runs its pipelines left to right, skipping a pipeline after && when the previous
+            status was non-zero and after || when it was zero; a background chain of more than
+            one pipeline runs in a forked copy of the shell registered as one job
+    Output: returns the exit status of the last pipeline run (0 for a background job)
+    """
+
+    global LAST_STATUS
+    if background and node.rest:
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+        try:
+            sys.stdout.flush()
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    os.setpgid(0, 0)
+                    JOBS.clear()
+                    JOB_PIDS.clear()
+                    signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+                    status = runAndOr(node)
+                finally:
+                    sys.stdout.flush()
+                    os._exit(status)
+            try:
+                os.setpgid(pid, pid)
+            except OSError:
+                pass
+            job = addJob(pid, [pid], node.text)
+            print("[" + str(job.id) + "]", pid)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+        return 0
+
+    status = LAST_STATUS = runPipelineNode(node.first, background)
+    for operator, pipeline in node.rest:
+        if (status == 0) == (operator == "&&"):
+            status = LAST_STATUS = runPipelineNode(pipeline)
+    return status
+
+
+def runPipelineNode(node, background=False):
+    """Returns the exit status of a Pipeline node.
+
+    Input: takes a Pipeline node and whether to run it in the background
+    Action: expands its words; a single foreground command without redirections, or a builtin
+            with them (see runRedirected), is dispatched in-process, anything else goes
+            through runPipeline. A "time" prefix prints the wall time and
+            the children's CPU time and max RSS to stderr.
+    Output: returns the exit status of the pipeline's last command
+    """
+    usage = beginUsage()
+    stages = [expandCommand(command) for command in node.commands]
+    pipeline = False
+    if any(not fields for fields, _ in stages):
+        if len(stages) == 1 and not stages[0][1]:
+            status = 0      # the command expanded to nothing
+        else:
+            print(Fore.RED + "ERROR - empty command in: " + node.text + Fore.WHITE)
+            status = 2
+    elif len(stages) == 1 and not stages[0][1] and not background:
+        status = COMMANDS.dispatch(stages[0][0])
+    elif len(stages) == 1 and not background and COMMANDS.resolve(stages[0][0])[1] is not COMMANDS.fallback:
+        status = runRedirected(*stages[0])
+    else:
+        status = runPipeline(stages, background, node.text)
+        pipeline = not background
+    usage = endUsage(usage)
+    if pipeline:
+        COMMANDS.record(" | ".join(fields[0] for fields, _ in stages), stages[0][0], status, usage)
+    if node.timed:
+        sys.stdout.flush()
+        sys.stderr.write("real %.3fs  user %.3fs  sys %.3fs  maxrss %d KB\n" % usage)
+    return status
+
+
+def readCommands(stream):
+    """Yields command lines from stream one at a time.
+
+    Input: takes an open text stream (file, pipe or io.StringIO)
+    Action: reads lazily, so the whole script is never held in memory
+    Output: yields (line number, line) pairs without the trailing newline
+    """
+    for lineno, line in enumerate(stream, 1):
+        yield lineno, line.rstrip('\n')
+
+
+def runBatch(stream, report=False):
+    """Returns the exit status of the last command after running every line of stream.
+
+    Input: takes an open text stream and whether to report each command's status
+    Action: runs each line without printing a prompt, stopping cleanly at EOF;
+            with report set, writes "<line number>\t<status>\t<line>" to stderr
+    Output: returns exit status of the last command run
+    """
+    for lineno, line in readCommands(stream):
+        status = runLine(line)
+        if report and status is not None:
+            sys.stdout.flush()
+            sys.stderr.write(str(lineno) + "\t" + str(status) + "\t" + line + "\n")
+    return LAST_STATUS
+
+
+def runInteractive():
+    """Returns the exit status of the last command after an interactive session.
+
+    Input: no function arguments
+    Action: prompts for commands until EOF (Ctrl-D) or the exit command, recording each
+            one in the history file (recall with the arrow keys when readline is available);
+            Ctrl-C abandons the current line or builtin with status 130
+    Output: returns exit status of the last command run
+    """
+    global LAST_STATUS
+    # the shell hands the terminal to fg jobs and must be able to take it back
+    signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+    history = getHistory()
+    loadReadline(history)
+    while True:
+        notifyJobs()
+        try:
+            line = input("PShell>")
+        except EOFError:
+            print()
+            return LAST_STATUS
+        except KeyboardInterrupt:
+            print()
+            continue
+        if history is not None and line.strip():
+            history.append(line)
+        try:
+            runLine(line)
+        except KeyboardInterrupt:
+            print()
+            LAST_STATUS = 130
+
+
+def reportStartup():
+    """Writes the time each startup phase in STARTUP took, and how many modules are loaded, to stderr."""
+    phases = ["%s %.2f ms" % (name, 1000 * (end - STARTUP[i][1])) for i, (name, end) in enumerate(STARTUP[1:])]
+    sys.stderr.write("startup: " + ", ".join(phases) + "; total %.2f ms, %d modules loaded\n"
+                     % (1000 * (STARTUP[-1][1] - STARTUP[0][1]), len(sys.modules)))
+
+
+# Command-line options: flag -> (attribute of the parsed arguments, whether it takes a value)
+SHELL_OPTIONS = {"-c": ("command", True), "--status": ("status", False), "--trace": ("trace", True),
+                 "--async": ("use_async", False), "--startup-profile": ("startup_profile", False),
+                 "--fast-builtins": ("fast_builtins", False)}
+
+
+def parseArgs(argv):
+    """Returns the parsed command-line options of the shell.
+
+    Well-formed arguments are parsed directly from SHELL_OPTIONS; argparse, which is slow to
+    import, is only loaded to print --help or to report a usage error.
+    """
+    values = {name: None if takesValue else False for name, takesValue in SHELL_OPTIONS.values()}
+    values["script"] = None
+    i = 0
+    while i < len(argv):
+        option = SHELL_OPTIONS.get(argv[i])
+        if option is not None and (not option[1] or i + 1 < len(argv)):
+            name, takesValue = option
+            if takesValue:
+                i += 1
+            values[name] = argv[i] if takesValue else True
+        elif values["script"] is None and (argv[i] == "-" or not argv[i].startswith("-")):
+            values["script"] = argv[i]
+        else:
+            return argumentParser().parse_args(argv)
+        i += 1
+    import types
+    return types.SimpleNamespace(**values)
+
+
+def argumentParser():
+    """Returns the argparse parser describing the shell's command-line options."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Simple shell to start programs.")
+    parser.add_argument("-c", dest="command", metavar="COMMANDS",
+                        help="run the given commands (one per line) and exit")
+    parser.add_argument("--status", action="store_true",
+                        help="report every command's exit status on stderr")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="append one JSON line per command run to FILE")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run commands on the asyncio core (AsyncSession)")
+    parser.add_argument("--fast-builtins", action="store_true",
+                        help="run ls, cat, echo, true, false, pwd, mkdir and touch in-process (set fastpath on)")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="report the time spent in imports and initialization on stderr")
+    parser.add_argument("script", nargs="?",
+                        help="file of commands to run, or - for standard input")
+    return parser
+
+# ---------------------------------------------------------------------
+
+def main(argv=None):
+    """Returns the exit code of the last command (after executing the main part of this script).
+    
+    Input: optional list of command-line arguments (defaults to sys.argv[1:])
+    Action: runs commands from -c, a script file, piped stdin or an interactive prompt
+    Output: return exit status of the last command to indicate how the shell terminated
+    """
+
+    args = parseArgs(sys.argv[1:] if argv is None else argv)
+    if SETTINGS["launcher"] not in SETTING_CHOICES["launcher"]:
+        SETTINGS["launcher"] = SETTING_CHOICES["launcher"][-1]
+    if args.fast_builtins:
+        SETTINGS["fastpath"] = "on"
+    elif SETTINGS["fastpath"] not in SETTING_CHOICES["fastpath"]:
+        SETTINGS["fastpath"] = "off"
+    signal.signal(signal.SIGCHLD, reapJobs)
+    if args.trace:
+        SETTINGS["trace"] = args.trace
+    STARTUP.append(("arguments", time.perf_counter()))
+    if args.startup_profile:
+        reportStartup()
+    batch, interactive = runBatch, runInteractive
+    if args.use_async:
+        import asyncio
+        batch = lambda stream, report: asyncio.run(runAsyncBatch(stream, report))
+        interactive = lambda: asyncio.run(runAsyncInteractive())
+    if args.command is not None:
+        return batch(io.StringIO(args.command), args.status)
+    if args.script is not None and args.script != "-":
+        try:
+            with open(args.script) as script:
+                return batch(script, args.status)
+        except OSError as error:
+            print(Fore.RED + "ERROR - Cannot read script: " + str(error) + Fore.WHITE)
+            return 127
+    if args.script == "-" or not sys.stdin.isatty():
+        return batch(sys.stdin, args.status)
+    return interactive()
+
+
+COMMANDS = CommandRegistry(runCmd)
+COMMANDS.register("files", filesCmd)
+COMMANDS.register("info", infoCmd)
+COMMANDS.register("delete", deleteCmd)
+COMMANDS.register("copy", copyCmd)
+COMMANDS.register("usage", usageCmd)
+COMMANDS.register("du", usageCmd)
+COMMANDS.register("sync", syncCmd)
+COMMANDS.register("search", searchCmd)
+COMMANDS.register("watch", watchCmd)
+COMMANDS.fastpath("true", fastTrue)
+COMMANDS.fastpath("false", fastFalse)
+COMMANDS.fastpath("echo", fastEcho)
+COMMANDS.fastpath("pwd", fastPwd)
+COMMANDS.fastpath("cat", fastCat)
+COMMANDS.fastpath("ls", fastLs)
+COMMANDS.fastpath("mkdir", fastMkdir)
+COMMANDS.fastpath("touch", fastTouch)
+COMMANDS.register("where", whereCmd)
+COMMANDS.register("down", downCmd)
+COMMANDS.register("up", upCmd)
+COMMANDS.register("exit", exitCmd)
+COMMANDS.register("rehash", rehashCmd)
+COMMANDS.register("alias", aliasCmd)
+COMMANDS.register("jobs", jobsCmd)
+COMMANDS.register("fg", fgCmd)
+COMMANDS.register("bg", bgCmd)
+COMMANDS.register("wait", waitCmd)
+COMMANDS.register("set", setCmd)
+COMMANDS.register("parallel", parallelCmd)
+COMMANDS.register("stats", statsCmd)
+COMMANDS.register("history", historyCmd)
+COMMANDS.register("cd", cdCmd)
+COMMANDS.register("pushd", pushdCmd)
+COMMANDS.register("popd", popdCmd)
+COMMANDS.register("dirs", dirsCmd)
+COMMANDS.register("jump", jumpCmd)
+STARTUP.append(("init", time.perf_counter()))
 
 if __name__ == '__main__':
     sys.exit(main()) # run main function and then exit
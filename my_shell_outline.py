@@ -9,16 +9,22 @@ see https://peps.python.org/pep-0008 and https://peps.python.org/pep-0257/
 (Note: The breakdown into Input/Action/Output in this script is just a suggestion.)
 """
 
-from datetime import datetime
-import glob
 import os
-import pwd
-import shutil
 import sys
-import time
-import glob
-import colorama
-from colorama import Fore
+
+
+class PlainColors:
+    """Stands in for colorama's Fore when output is not a terminal: every color is empty text."""
+
+    def __getattr__(self, name):
+        return ""
+
+
+# colorama is only imported when its colors would be seen
+if sys.stdout.isatty():
+    from colorama import Fore
+else:
+    Fore = PlainColors()
 
 # ========================
 #    files command
@@ -60,6 +66,7 @@ def info_cmd(fields):
     if checkArgs(fields, 1):
             #Assign inputted param to var
             filename = fields[1]
+            import pwd, time
             try:
                 #Have an OS.stat object
                 Result = os.stat(filename)
@@ -74,10 +81,10 @@ def info_cmd(fields):
                     #Print extra info
                     print(Fore.BLUE + "Type: " +Fore.WHITE +"File")
                     print(Fore.BLUE + 'Size (Bytes): ' + Fore.WHITE + str(Result.st_size))
-                    print(Fore.BLUE + 'Date of last access: ' +Fore.WHITE + datetime.fromtimestamp(os.path.getatime(filename)).strftime('%b %d %Y %H:%M:%S'))
-                    print(Fore.BLUE + 'Date of last access permissions modification: ' +Fore.WHITE + datetime.fromtimestamp(os.path.getctime(filename)).strftime('%b %d %Y %H:%M:%S'))
+                    print(Fore.BLUE + 'Date of last access: ' +Fore.WHITE + time.strftime('%b %d %Y %H:%M:%S', time.localtime(Result.st_atime)))
+                    print(Fore.BLUE + 'Date of last access permissions modification: ' +Fore.WHITE + time.strftime('%b %d %Y %H:%M:%S', time.localtime(Result.st_ctime)))
                 
-                print(Fore.BLUE + 'Date of last modification: ' +Fore.WHITE + datetime.fromtimestamp(os.path.getmtime(filename)).strftime('%b %d %Y %H:%M:%S'))
+                print(Fore.BLUE + 'Date of last modification: ' +Fore.WHITE + time.strftime('%b %d %Y %H:%M:%S', time.localtime(Result.st_mtime)))
                 print(Fore.BLUE + "Executable? : " +Fore.WHITE + str(os.access(os.path.abspath(filename), os.X_OK)))
             #Error handling
             except:
@@ -134,6 +141,7 @@ def copy_cmd(fields):
         fromFile = fields[1]
         toFile = fields[2]
         if os.path.exists(fromFile) and not os.path.exists(toFile):
+            import shutil
             shutil.copyfile(fromFile, toFile)
             print(Fore.BLUE + "File Copied successfully. " + Fore.WHITE)
         else:
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+"""shell_bench.py:
+Benchmarks for the hot paths of my_run_shell_0.py, e.g., try "python shell_bench.py run --quick".
+
+run:     runs the benchmark suite in temporary directories and writes the results as JSON
+         (add_path lookups, runCmd spawn latency, files, info, copy and command dispatch)
+compare: compares two JSON result files and exits with status 1 if any benchmark got slower
+         than the allowed threshold
+spawn:   compares the latency of launching a program with the "fork" and "spawn" launchers,
+         optionally after growing the process (--rss-mb) to show how fork's cost follows
+         the size of the shell
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import my_run_shell_0 as shell
+
+# every benchmark name, in the order "run" executes them
+BENCHMARKS = ["add_path", "spawn", "files", "info", "copy", "dispatch"]
+
+
+def timeit(function, count, repeat):
+    """Returns the best mean seconds per call of function over repeat rounds of count calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            function()
+        best = min(best, (time.perf_counter() - start) / count)
+    return best
+
+
+def result(name, perOp, ops, **params):
+    """Returns one benchmark result record."""
+    record = {"name": name, "params": params, "ops": ops, "us_per_op": perOp * 1e6}
+    if "bytes" in params:
+        record["mb_per_s"] = params["bytes"] / perOp / 1e6
+    return record
+
+
+@contextlib.contextmanager
+def quiet():
+    """Sends everything the shell prints (Python-level stdout) to /dev/null."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+@contextlib.contextmanager
+def insideDirectory(path):
+    """Runs the body with the shell's working directory set to path."""
+    previous = shell.CWD
+    shell.changeDirectory(path)
+    try:
+        yield
+    finally:
+        shell.changeDirectory(previous)
+
+
+def makeEntries(path, count):
+    """Creates count empty files in directory path (one in 100 is a sub directory instead)."""
+    os.makedirs(path, exist_ok=True)
+    for i in range(count):
+        name = os.path.join(path, "entry%07d" % i)
+        if i % 100 == 0:
+            os.mkdir(name)
+        else:
+            os.close(os.open(name, os.O_WRONLY | os.O_CREAT, 0o644))
+
+
+def benchAddPath(args, work):
+    """Returns results for resolving commands with add_path, from a cold and a warm cache."""
+    commands = ["ls", "cat", "true", "sh", "env", "no-such-command"]
+
+    def cold():
+        shell.PATH_INDEX.clear()
+        shell.PATH_RESOLVED.clear()
+        for command in commands:
+            shell.add_path(command, shell.THE_PATH)
+
+    # a command that is not found is never cached, so the warm loop only looks up found ones
+    found = [command for command in commands if shell.add_path(command, shell.THE_PATH)]
+
+    def warm():
+        for command in found:
+            shell.add_path(command, shell.THE_PATH)
+
+    count = 20 if args.quick else 200
+    results = [result("add_path.cold", timeit(cold, count, args.repeat) / len(commands), count * len(commands))]
+    warm()
+    misses = shell.PATH_STATS["misses"]
+    perOp = timeit(warm, count * 100, args.repeat) / len(found)
+    misses = shell.PATH_STATS["misses"] - misses
+    if misses:
+        raise RuntimeError("add_path.cached: %d lookups missed the cache" % misses)
+    results.append(result("add_path.cached", perOp, count * 100 * len(found)))
+    return results
+
+
+def benchSpawn(args, work):
+    """Returns results for running /bin/true through runCmd with each launcher, and "true" with and without fast paths."""
+    count = 500 if args.quick else 10000
+    results = []
+    saved = shell.SETTINGS["launcher"]
+    try:
+        for launcher in shell.SETTING_CHOICES["launcher"]:
+            shell.SETTINGS["launcher"] = launcher
+            perOp = timeit(lambda: shell.runCmd(["/bin/true"]), count, 1)
+            results.append(result("runCmd.true", perOp, count, launcher=launcher))
+    finally:
+        shell.SETTINGS["launcher"] = saved
+
+    saved = shell.SETTINGS["fastpath"]
+    try:
+        for fastpath in shell.SETTING_CHOICES["fastpath"]:
+            shell.SETTINGS["fastpath"] = fastpath
+            perOp = timeit(lambda: shell.COMMANDS.dispatch(["true"]), count, 1)
+            results.append(result("dispatch.true", perOp, count, fastpath=fastpath))
+    finally:
+        shell.SETTINGS["fastpath"] = saved
+    return results
+
+
+def benchFiles(args, work):
+    """Returns results for filesCmd (plain and -l) on directories of each size in --sizes."""
+    results = []
+    for size in args.sizes:
+        path = os.path.join(work, "files%d" % size)
+        makeEntries(path, size)
+        with insideDirectory(path), quiet():
+            for fields in (["files"], ["files", "-l"]):
+                perOp = timeit(lambda: shell.filesCmd(fields), 1, args.repeat)
+                results.append(result("files" + "".join(fields[1:]), perOp / size, size, entries=size))
+        shutil.rmtree(path)
+    return results
+
+
+def benchInfo(args, work):
+    """Returns per-file results for infoCmd (text and --json) over a directory of files."""
+    count = 1000 if args.quick else 20000
+    path = os.path.join(work, "info")
+    makeEntries(path, count)
+    names = [os.path.join(path, name) for name in os.listdir(path)]
+    results = []
+    with quiet():
+        for fields in (["info"], ["info", "--json"]):
+            perOp = timeit(lambda: shell.infoCmd(fields + names), 1, args.repeat)
+            results.append(result("info" + "".join(fields[1:]), perOp / count, count, files=count))
+    shutil.rmtree(path)
+    return results
+
+
+def benchCopy(args, work):
+    """Returns throughput results for copyCmd on files of each size in --copy-mb."""
+    results = []
+    chunk = os.urandom(1024 * 1024)
+    for megabytes in args.copy_mb:
+        source = os.path.join(work, "copy-source")
+        with open(source, "wb") as data:
+            for _ in range(megabytes):
+                data.write(chunk)
+        dest = os.path.join(work, "copy-dest")
+
+        def copyOnce():
+            shell.copyCmd(["copy", source, dest])
+            os.unlink(dest)
+
+        with quiet():
+            perOp = timeit(copyOnce, 1, args.repeat)
+        results.append(result("copy", perOp, 1, bytes=megabytes * 1024 * 1024))
+        os.unlink(source)
+    return results
+
+
+def benchDispatch(args, work):
+    """Returns results for the per-line overhead of runLine and of CommandRegistry.dispatch."""
+    shell.COMMANDS.register("bench-noop", lambda fields: 0)
+    count = 20000 if args.quick else 200000
+    return [
+        result("dispatch.registry", timeit(lambda: shell.COMMANDS.dispatch(["bench-noop", "a", "b"]), count, args.repeat), count),
+        result("dispatch.runLine", timeit(lambda: shell.runLine("bench-noop a 'b c' $HOME"), count, args.repeat), count),
+    ]
+
+
+def runMain(args):
+    """Returns 0 after running the selected benchmarks and writing their results as JSON."""
+    if args.quick:
+        args.sizes = args.sizes or [1000, 10000]
+        args.copy_mb = args.copy_mb or [1, 16]
+    args.sizes = args.sizes or [1000, 100000, 1000000]
+    args.copy_mb = args.copy_mb or [1, 64, 512]
+    functions = {"add_path": benchAddPath, "spawn": benchSpawn, "files": benchFiles,
+                 "info": benchInfo, "copy": benchCopy, "dispatch": benchDispatch}
+
+    report = {
+        "time": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": [],
+    }
+    work = tempfile.mkdtemp(prefix="pshell-bench-", dir=args.tmpdir)
+    try:
+        for name in args.only or BENCHMARKS:
+            sys.stderr.write("running " + name + "...\n")
+            report["results"].extend(functions[name](args, work))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+def resultKey(record):
+    """Returns the identity of a result: its name plus its parameters."""
+    return record["name"] + json.dumps(record["params"], sort_keys=True)
+
+
+def compareMain(args):
+    """Returns 1 if any benchmark in args.new is slower than in args.old by more than args.threshold percent."""
+    with open(args.old) as old, open(args.new) as new:
+        before = {resultKey(record): record for record in json.load(old)["results"]}
+        after = json.load(new)["results"]
+
+    regressions = 0
+    for record in after:
+        previous = before.get(resultKey(record))
+        if previous is None:
+            continue
+        change = 100 * (record["us_per_op"] / previous["us_per_op"] - 1)
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        label = record["name"] + " " + " ".join("%s=%s" % item for item in record["params"].items())
+        print(label.ljust(48) + ("%12.2f" % previous["us_per_op"]) + ("%12.2f" % record["us_per_op"])
+              + ("%+9.1f%%" % change) + flag)
+    return 1 if regressions else 0
+
+
+def launchLatency(program, count, launcher):
+    """Returns the mean seconds per launch-and-wait of program with the given launcher.
+
+    Input: takes the full path of a program, how many times to run it and a launcher name
+    Action: runs the program count times through shell.launchProgram, waiting for each
+    Output: returns mean wall-clock seconds per run
+    """
+    shell.SETTINGS["launcher"] = launcher
+    fields = [os.path.basename(program)]
+    start = time.perf_counter()
+    for _ in range(count):
+        pid = shell.launchProgram(program, fields)
+        os.waitpid(pid, 0)
+    return (time.perf_counter() - start) / count
+
+
+def spawnMain(args):
+    """Returns 0 after printing fork vs spawn launch latency."""
+    ballast = bytearray(args.rss_mb * 1024 * 1024)
+    # touch every page so it is really resident and fork has page tables to copy
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+
+    print("program:", args.program, " runs:", args.count, " extra RSS (MB):", args.rss_mb)
+    for launcher in shell.SETTING_CHOICES["launcher"]:
+        launchLatency(args.program, min(args.count, 50), launcher)    # warm up
+        mean = launchLatency(args.program, args.count, launcher)
+        print(launcher.ljust(6), "%9.1f us/run" % (mean * 1e6))
+    return 0
+
+
+def main(argv=None):
+    """Returns the exit code of the selected sub command."""
+    parser = argparse.ArgumentParser(description="Benchmarks for my_run_shell_0.py")
+    commands = parser.add_subparsers(dest="bench", required=True)
+
+    run = commands.add_parser("run", help="run the benchmark suite and write JSON results")
+    run.add_argument("--only", nargs="+", choices=BENCHMARKS, help="benchmarks to run (default: all)")
+    run.add_argument("--quick", action="store_true", help="small sizes and counts, for a smoke test")
+    run.add_argument("--sizes", type=int, nargs="+", help="directory sizes for files (default: 1000 100000 1000000)")
+    run.add_argument("--copy-mb", type=int, nargs="+", help="file sizes in MB for copy (default: 1 64 512)")
+    run.add_argument("--repeat", type=int, default=3, help="rounds per measurement; the best is kept")
+    run.add_argument("--tmpdir", help="where to create the temporary work directory")
+    run.add_argument("-o", "--output", help="write the JSON to this file instead of stdout")
+    run.set_defaults(run=runMain)
+
+    compare = commands.add_parser("compare", help="compare two JSON result files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    compare.set_defaults(run=compareMain)
+
+    spawn = commands.add_parser("spawn", help="fork/exec vs posix_spawn launch latency")
+    spawn.add_argument("-n", "--count", type=int, default=2000, help="runs per launcher")
+    spawn.add_argument("--rss-mb", type=int, default=0, help="grow the process by this many MB first")
+    spawn.add_argument("--program", default="/bin/true", help="program to launch")
+    spawn.set_defaults(run=spawnMain)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())